@@ -0,0 +1 @@
+# Benchmarks of the render -> pack -> transmit pipeline, see run.py
@@ -0,0 +1,242 @@
+#! /usr/bin/env python
+#
+# cases.py -- the benchmarked hot paths of render -> pack -> transmit
+#
+# Each case is a generator taking the wall sizes to cover. It sets up what
+# it needs, yields (name, params, fn, ops) for every variant, where fn is
+# timed and does ops units of work per call, then tears down once the
+# runner moves on. If ops is None fn times itself, once per repeat, and
+# returns the seconds taken.
+
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from flipdot import display, sim
+from flipdot.client import Client
+from flipdot.sequence import CaptureDisplay
+
+from benchmarks.sinks import SINKS, UDPSink
+
+PANEL = (28, 7)
+
+# panels -> wall size, from one panel up to 20+
+WALLS = {
+    1: (28, 7),
+    4: (56, 14),
+    8: (112, 14),
+    24: (168, 28),
+}
+
+# seconds a benchmark's median must stay within, whatever the baseline
+BUDGETS = {
+    # README: first frame within 120 ms of process start
+    'startup.first_frame': 0.120,
+}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# a gateway display of 8 panels for the multi display cases, with walls of
+# that many gateways side by side
+GATEWAY = (56, 28)
+GATEWAYS = {8: 1, 24: 3}
+
+
+def noise(im, seed=1):
+    """
+    Fill an image with random dots so packing isn't of a blank frame
+    """
+    rnd = random.Random(seed)
+    w, h = im.size
+    dot = {'1': 1, 'L': 255, 'RGB': (255, 255, 255)}[im.mode]
+    blank = {'1': 0, 'L': 0, 'RGB': (0, 0, 0)}[im.mode]
+    im.putdata([dot if rnd.random() < 0.5 else blank for _ in range(w * h)])
+
+
+def wall(panels, mode='RGB'):
+    w, h = WALLS[panels]
+    d = display.Display(w, h, display.create_display(PANEL, (w, h)), mode=mode)
+    noise(d.im)
+    return d
+
+
+def pack(walls):
+    for panels in walls:
+        for mode in ('RGB', '1'):
+            d = wall(panels, mode)
+            yield 'display.pack', {'panels': panels, 'mode': mode}, d.pack, 1
+
+
+def to_bytes(walls):
+    for panels in walls:
+        d = wall(panels)
+        # the last panel, as a single panel update would ask for
+        address = max(d.panels)
+        yield 'display.to_bytes', {'panels': panels}, lambda: d.to_bytes(address), 1
+        # every panel in turn, as callers updating panel by panel do
+        addresses = sorted(d.panels)
+        yield 'display.to_bytes', {'panels': panels, 'loop': 'all'}, \
+            lambda: [d.to_bytes(a) for a in addresses], 1
+
+
+def send(walls):
+    for kind, sink in SINKS.items():
+        s = sink()
+        try:
+            for panels in walls:
+                d = wall(panels)
+                d.connect(s.client())
+                try:
+                    yield 'display.send', {'sink': kind, 'panels': panels}, \
+                        lambda: d.send(force=True), 1
+                finally:
+                    d.disconnect()
+        finally:
+            s.close()
+
+
+class NullClient(Client):
+    """
+    Client whose writes go nowhere, so only formatting is timed
+    """
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def write(self, b):
+        pass
+
+
+def send_many(walls):
+    # the formatting every Display.send goes through, for a whole wall
+    for panels in walls:
+        c = NullClient()
+        batch = sorted((a, data, True) for a, data in wall(panels).pack().items())
+        yield 'client.send_many', {'panels': panels}, lambda: c.send_many(batch), 1
+
+
+def multi(walls):
+    for portrait in (False, True):
+        for panels, count in GATEWAYS.items():
+            if panels > max(walls):
+                continue
+            w, h = GATEWAY
+            displays = {}
+            for i in range(count):
+                if portrait:
+                    # portrait gateways are tall and turned on their side
+                    disp = display.Display(h, w, display.create_display(PANEL, (h, w)))
+                    displays[i] = ((0, w * i), disp)
+                else:
+                    disp = display.Display(w, h, display.create_display(PANEL, (w, h)))
+                    displays[i] = ((w * i, 0), disp)
+            md = display.MultiDisplay(w * count, h, displays, portrait=portrait)
+            noise(md.im)
+            sinks = {i: UDPSink() for i in displays}
+            md.connect({i: s.client() for i, s in sinks.items()})
+            try:
+                yield 'multidisplay.send', \
+                    {'layout': 'portrait' if portrait else 'landscape', 'panels': panels}, \
+                    lambda: md.send(force=True), 1
+            finally:
+                md.disconnect()
+                for s in sinks.values():
+                    s.close()
+
+
+def scroll_text(walls):
+    from demo import animations
+    animations.asset('BigFont')
+    text = 'Flip dots scroll'
+    for panels in walls:
+        w, h = WALLS[panels]
+        d = CaptureDisplay(w, h, display.create_display(PANEL, (w, h)))
+        animations.scroll_text(d, text)
+        frames = len(d.captured)
+
+        def run():
+            d.captured = []
+            animations.scroll_text(d, text)
+
+        # per frame, render and pack
+        yield 'animations.scroll_text', {'panels': panels}, run, frames
+
+
+def frames(panels):
+    """
+    The frames a client sends for a whole wall, back to back as one batch
+    """
+    d = wall(panels)
+    c = Client()
+    return [bytes(c.format_message(a, data, True)) for a, data in sorted(d.pack().items())]
+
+
+def simulator(walls):
+    # Handler.validate of the old simulator became sim.problem
+    msg = frames(1)[0]
+    yield 'sim.problem', {'bytes': len(msg) - 4}, lambda: sim.problem(msg), 1
+    for panels in walls:
+        w, h = WALLS[panels]
+        s = sim.DisplaySim(w, h, display.create_display(PANEL, (w, h)))
+        msgs = frames(panels)
+        updates = [(m[2], m[3:-1]) for m in msgs]
+
+        def update():
+            for address, data in updates:
+                s.update(address, data)
+
+        batch = b''.join(msgs)
+        parser = sim.FrameParser()
+
+        def stream():
+            for i in range(0, len(batch), 1460):
+                s.apply(batch[i:i + 1460], parser)
+
+        # per panel for updates, per wall frame as received otherwise
+        yield 'sim.update', {'panels': panels}, update, len(updates)
+        yield 'sim.apply', {'panels': panels, 'transport': 'datagram'}, \
+            lambda: s.apply(batch), 1
+        yield 'sim.apply', {'panels': panels, 'transport': 'stream'}, stream, 1
+
+
+def startup(walls):
+    # cold start of the text path: process start to the first frame arriving
+    # at a loopback UDP socket, as `python -m flipdot "text"`
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(10)
+    command = [sys.executable, '-m', 'flipdot', '-i', '127.0.0.1',
+               '-p', str(sock.getsockname()[1]), 'Hello']
+
+    def run():
+        start = time.perf_counter()
+        p = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL)
+        try:
+            sock.recv(65536)
+        finally:
+            p.kill()
+            p.wait()
+        elapsed = time.perf_counter() - start
+        # drain what was sent before the kill, for the next run
+        sock.setblocking(False)
+        try:
+            while True:
+                sock.recv(65536)
+        except OSError:
+            pass
+        sock.settimeout(10)
+        return elapsed
+
+    try:
+        yield 'startup.first_frame', {}, run, None
+    finally:
+        sock.close()
+
+
+CASES = [pack, to_bytes, send, send_many, multi, scroll_text, simulator, startup]
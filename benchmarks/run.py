@@ -0,0 +1,190 @@
+#! /usr/bin/env python
+#
+# run.py -- run the benchmarks, save the results as JSON and compare them
+# against a baseline
+#
+#   python -m benchmarks -o results.json
+#   python -m benchmarks --compare baseline.json
+#   python -m benchmarks --input results.json --compare baseline.json
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+
+import PIL
+
+from benchmarks.cases import BUDGETS, CASES, WALLS
+
+# result file layout, bump if it changes incompatibly
+FORMAT = 1
+
+parser = argparse.ArgumentParser(description='Benchmark the flipdot render, pack and transmit pipeline')
+parser.add_argument('-o', '--output', help='write results to this JSON file')
+parser.add_argument('-c', '--compare', metavar='BASELINE',
+                    help='compare against the results in this JSON file, exit 1 on regressions')
+parser.add_argument('-i', '--input', metavar='RESULTS',
+                    help='use results from this JSON file rather than running')
+parser.add_argument('-t', '--threshold', type=float, default=0.15,
+                    help='slow down as a fraction of the baseline to flag as a regression')
+parser.add_argument('-k', '--filter', default='',
+                    help='only run benchmarks whose name contains this')
+parser.add_argument('-p', '--panels', type=int, nargs='+', default=sorted(WALLS),
+                    choices=sorted(WALLS), help='wall sizes to cover, in panels')
+parser.add_argument('--min-time', type=float, default=0.1,
+                    help='seconds each timing repeat should take at least')
+parser.add_argument('--repeat', type=int, default=5,
+                    help='timing repeats, the median and best are kept')
+parser.add_argument('-q', '--quick', action='store_true',
+                    help='short run of the smallest and largest walls, for a smoke test')
+
+
+def key(name, params):
+    """
+    Unique name of a benchmark variant, as used to match results
+    """
+    return '{}[{}]'.format(name, ','.join('{}={}'.format(k, v) for k, v in sorted(params.items())))
+
+
+def measure(fn, ops=1, min_time=0.1, repeat=5):
+    """
+    Time fn like timeit: calls per repeat are raised until a repeat takes
+    at least min_time. Returns seconds per op of each repeat. If ops is
+    None fn is called once per repeat and returns its own timing.
+    """
+    if ops is None:
+        return [fn() for _ in range(repeat)]
+    timer = time.perf_counter
+    number = 1
+    while True:
+        start = timer()
+        for _ in range(number):
+            fn()
+        elapsed = timer() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    times = [elapsed]
+    for _ in range(repeat - 1):
+        start = timer()
+        for _ in range(number):
+            fn()
+        times.append(timer() - start)
+    return [t / (number * ops) for t in times]
+
+
+def run(walls, pattern='', min_time=0.1, repeat=5, out=sys.stdout):
+    """
+    Run every benchmark variant, returns dict of key -> result
+    """
+    results = {}
+    for case in CASES:
+        for name, params, fn, ops in case(walls):
+            if 'panels' in params and params['panels'] not in walls:
+                continue
+            if pattern not in name:
+                continue
+            times = measure(fn, ops, min_time, repeat)
+            median = statistics.median(times)
+            k = key(name, params)
+            results[k] = {
+                'name': name,
+                'params': params,
+                'median': median,
+                'best': min(times),
+                'ops_per_sec': 1.0 / median if median else 0.0,
+            }
+            budget = BUDGETS.get(name)
+            if budget is not None:
+                results[k]['budget'] = budget
+            print('{:<60} {:>12.2f} us {:>14.0f} /s {}'.format(
+                k, median * 1e6, 1.0 / median, over_budget(results[k])), file=out)
+    return results
+
+
+def over_budget(result):
+    """
+    Flag for a result slower than its budget, empty if it has none or is
+    within it
+    """
+    budget = result.get('budget')
+    if budget is not None and result['median'] > budget:
+        return 'OVER BUDGET ({:.0f} ms)'.format(budget * 1e3)
+    return ''
+
+
+def save(path, results):
+    doc = {
+        'format': FORMAT,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'pillow': PIL.__version__,
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(doc, f, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as f:
+        doc = json.load(f)
+    if doc.get('format') != FORMAT:
+        raise ValueError('{} has result format {}, expected {}'.format(path, doc.get('format'), FORMAT))
+    return doc['results']
+
+
+def compare(baseline, results, threshold=0.15, out=sys.stdout):
+    """
+    Print the change of each benchmark in both sets of results, returns the
+    keys slower than the baseline by more than threshold
+    """
+    regressions = []
+    for k in sorted(set(baseline) & set(results)):
+        old, new = baseline[k]['median'], results[k]['median']
+        change = new / old - 1.0 if old else 0.0
+        flag = ''
+        if change > threshold:
+            flag = 'REGRESSION'
+            regressions.append(k)
+        elif change < -threshold:
+            flag = 'faster'
+        print('{:<60} {:>10.2f} -> {:>10.2f} us {:>+7.1%} {}'.format(
+            k, old * 1e6, new * 1e6, change, flag), file=out)
+    for k in sorted(set(baseline) - set(results)):
+        print('{:<60} missing from results'.format(k), file=out)
+    return regressions
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    walls = [min(args.panels), max(args.panels)] if args.quick else args.panels
+    min_time = min(args.min_time, 0.02) if args.quick else args.min_time
+    repeat = min(args.repeat, 3) if args.quick else args.repeat
+
+    if args.input:
+        results = load(args.input)
+    else:
+        results = run(walls, args.filter, min_time, repeat)
+    if args.output:
+        save(args.output, results)
+
+    status = 0
+    over = [k for k, r in sorted(results.items()) if over_budget(r)]
+    if over:
+        print('{} benchmark(s) over budget: {}'.format(len(over), ', '.join(over)))
+        status = 1
+    if args.compare:
+        regressions = compare(load(args.compare), results, args.threshold)
+        if regressions:
+            print('{} regression(s) over {:.0%}'.format(len(regressions), args.threshold))
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
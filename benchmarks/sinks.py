@@ -0,0 +1,130 @@
+#! /usr/bin/env python
+#
+# sinks.py -- loopback endpoints and a fake serial port for clients to send
+# to while benchmarking
+
+import socket
+import threading
+
+from flipdot import client
+
+
+class UDPSink(threading.Thread):
+    """
+    Loopback UDP socket drained by a thread, counting what arrives
+    """
+
+    def __init__(self):
+        super(UDPSink, self).__init__()
+        self.daemon = True
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+        self.bytes = 0
+        self.start()
+
+    def client(self):
+        return client.UDPClient('127.0.0.1', self.port)
+
+    def run(self):
+        while True:
+            try:
+                self.bytes += len(self.sock.recv(65536))
+            except OSError:
+                return
+
+    def close(self):
+        self.sock.close()
+
+
+class TCPSink(threading.Thread):
+    """
+    Loopback TCP listener taking one connection at a time, drained by a
+    thread so that senders never block on a full window
+    """
+
+    def __init__(self):
+        super(TCPSink, self).__init__()
+        self.daemon = True
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(8)
+        self.port = self.sock.getsockname()[1]
+        self.bytes = 0
+        self.start()
+
+    def client(self):
+        return client.TCPClient('127.0.0.1', self.port)
+
+    def run(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.drain, args=(conn,), daemon=True).start()
+
+    def drain(self, conn):
+        with conn:
+            while True:
+                try:
+                    chunk = conn.recv(65536)
+                except OSError:
+                    return
+                if not chunk:
+                    return
+                self.bytes += len(chunk)
+
+    def close(self):
+        self.sock.close()
+
+
+class FakeSerial(object):
+    """
+    Stands in for serial.Serial, accepting writes instantly
+    """
+
+    def __init__(self):
+        self.bytes = 0
+        self.is_open = False
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def write(self, b):
+        self.bytes += len(b)
+        return len(b)
+
+
+class SerialSink(object):
+    """
+    Fake serial port for SerialClient, so the serial write path is measured
+    without hardware or bus pacing
+    """
+
+    def __init__(self):
+        self.port = FakeSerial()
+
+    @property
+    def bytes(self):
+        return self.port.bytes
+
+    def client(self):
+        c = client.SerialClient('fake')
+        c.chan = self.port
+        return c
+
+    def close(self):
+        pass
+
+
+SINKS = {
+    'udp': UDPSink,
+    'tcp': TCPSink,
+    'serial': SerialSink,
+}
@@ -2,70 +2,132 @@
 
 import random
 import os.path
-import time
 
 from PIL import Image, ImageDraw, ImageFont
 
+from flipdot import fonts
+from flipdot.scheduler import FrameScheduler
+from flipdot.text import renderer
+
 
 def rsrc(n):
     return os.path.join(os.path.dirname(__file__), n)
 
 
-a1 = Image.open(rsrc("images/a1.png"))
-a2 = Image.open(rsrc("images/a2.png"))
-frames1 = {0: a1, 1: a1, 2: a2, 3: a2}
-
-b1 = Image.open(rsrc("images/b1.png"))
-b2 = Image.open(rsrc("images/b2.png"))
-frames2 = {0: b1, 1: b1, 2: b2, 3: b2}
-
-p1 = Image.open(rsrc("images/p1.png"))
-p2 = Image.open(rsrc("images/p2.png"))
-frames3 = {0: p1, 1: p1, 2: p2, 3: p2}
-
-BigFont = ImageFont.truetype(rsrc("fonts/VeraBd.ttf"), 14)
-SmallFont = None
-
-
-def scroll_text(d, text, font=BigFont, xy=(0,0), rotate=False):
+# assets are loaded on first use, so importing the module costs nothing;
+# they are available as module attributes (animations.BigFont) or asset()
+ASSETS = {
+    'a1': lambda: Image.open(rsrc("images/a1.png")),
+    'a2': lambda: Image.open(rsrc("images/a2.png")),
+    'frames1': lambda: {0: asset('a1'), 1: asset('a1'), 2: asset('a2'), 3: asset('a2')},
+    'b1': lambda: Image.open(rsrc("images/b1.png")),
+    'b2': lambda: Image.open(rsrc("images/b2.png")),
+    'frames2': lambda: {0: asset('b1'), 1: asset('b1'), 2: asset('b2'), 3: asset('b2')},
+    'p1': lambda: Image.open(rsrc("images/p1.png")),
+    'p2': lambda: Image.open(rsrc("images/p2.png")),
+    'frames3': lambda: {0: asset('p1'), 1: asset('p1'), 2: asset('p2'), 3: asset('p2')},
+    'BigFont': lambda: ImageFont.truetype(rsrc("fonts/VeraBd.ttf"), 14),
+    'SmallFont': lambda: ImageFont.load_default(),
+}
+_assets = {}
+
+
+def asset(name):
+    a = _assets.get(name)
+    if a is None:
+        a = _assets[name] = ASSETS[name]()
+    return a
+
+
+def preload():
+    """
+    Load and decode every asset now rather than on first use, eg. before a
+    show starts
+    """
+    for name in ASSETS:
+        a = asset(name)
+        if hasattr(a, 'load'):
+            a.load()
+
+
+def __getattr__(name):
+    if name in ASSETS:
+        return asset(name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def text_canvas(d, rotate=False):
+    """
+    Image to draw text into for display d: the display image itself, or if
+    rotate a scratch image with w/h flipped so text is entered rotated
+    """
+    if rotate:
+        return Image.new(d.im.mode, d.im.size[::-1])
+    return d.im
+
+
+def show_canvas(d, im, rotate=False):
+    # rotate the scratch image back to display format
+    if rotate: d.im.paste(im.rotate(angle=-90, expand=1))
+
+
+def scroll_text(d, text, font=None, xy=(0,0), rotate=False):
+    # text is rendered once and scrolled as a window over the strip, in
+    # BigFont unless given; rotated, the strip is turned once and pasted
+    # further down the display each frame
+    r = renderer(font if font is not None else asset('BigFont'))
+    strip = r.render(text)
+    tw, th = strip.size
+    if rotate:
+        strip = strip.transpose(Image.ROTATE_270)
     draw = ImageDraw.Draw(d.im)
-    tw, _ = draw.textsize(text, font=font)
+    s = FrameScheduler(d, fps=1/0.06)
     for x in range(xy[0], 0-tw-1, -1):
-        if rotate: d.im = d.im.rotate(angle=90, expand=1)
-        draw = ImageDraw.Draw(d.im)
-        d.reset()
-        draw.text((x, xy[1]), text, font=font)
-        if rotate: d.im = d.im.rotate(angle=-90, expand=1)
-        d.send()
-        time.sleep(0.06)
+        draw.rectangle([(0, 0), d.im.size], fill=d.ink(False))
+        if rotate:
+            d.im.paste(strip, (d.im.size[0] - xy[1] - th, x), strip)
+        else:
+            d.im.paste(strip, (x, xy[1]), strip)
+        s.send()
+    s.finish()
     del draw
 
 
-def display_text(d, text, xy=(0,0), font=SmallFont, rotate=False, autoscroll=True):
-    draw = ImageDraw.Draw(d.im)
-    tw, _ = draw.textsize(text, font=font)
+def display_text(d, text, xy=(0,0), font=None, rotate=False, autoscroll=True):
+    # SmallFont unless given
+    font = font if font is not None else asset('SmallFont')
+    r = renderer(font)
+    im = text_canvas(d, rotate)
+    draw = ImageDraw.Draw(im)
+    tw, _ = r.size(text)
     # rotate so that text is entered with w/h flipped
-    if tw > d.im.size[0] and autoscroll: 
+    if tw > im.size[0] and autoscroll: 
         del draw
         scroll_text(d, text, font=font, xy=xy, rotate=rotate)
     else:
-        if rotate: d.im = d.im.rotate(angle=90, expand=1)
-        draw = ImageDraw.Draw(d.im)
-        d.reset()
-        draw.text(xy, text, font=font)
-        # now rotate the image back to display format
-        if rotate: d.im = d.im.rotate(angle=-90, expand=1)
+        draw.rectangle([(0, 0), im.size], fill=d.ink(False))
+        r.draw(im, xy, text)
+        show_canvas(d, im, rotate)
         d.send()
         del draw
 
 
+def scroll_bitmap_text(d, text, font=fonts.FONT_5X7, xy=(0,0)):
+    # composed straight into panel bytes, the display image is not used
+    s = FrameScheduler(d, fps=1/0.06)
+    for x in range(xy[0], 0-font.width(text)-1, -1):
+        s.send(packed=fonts.compose(d, text, font, (x, xy[1])))
+    s.finish()
+
+
 def blink_text(d, text, n=3):
+    s = FrameScheduler(d, fps=2)
     for _ in range(n):
+        s.tick(drop=False)
         display_text(d, text)
-        time.sleep(0.5)
         d.reset()
-        d.send()
-        time.sleep(0.5)
+        s.send(drop=False)
+    s.finish()
 
 
 def animate(disp, i, w, d=1):
@@ -74,12 +136,13 @@ def animate(disp, i, w, d=1):
     if d < 0:
         start, end = end, start
     # move the image across screen
+    s = FrameScheduler(disp, fps=10)
     for x in range(start, end, d):
         im = i[abs(x % len(i))]
         disp.reset()
         disp.im.paste(im, (x, 0))
-        disp.send()
-        time.sleep(0.1)
+        s.send()
+    s.finish()
 
 
 #
@@ -87,15 +150,15 @@ def animate(disp, i, w, d=1):
 #
 
 def alien_1(d):
-    animate(d, frames1, d.im.size[0], 1)
+    animate(d, asset('frames1'), d.im.size[0], 1)
 
 
 def alien_2(d):
-    animate(d, frames2, d.im.size[0], -1)
+    animate(d, asset('frames2'), d.im.size[0], -1)
 
 
 def gobble(d):
-    animate(d, frames3, d.im.size[0], 1)
+    animate(d, asset('frames3'), d.im.size[0], 1)
 
 
 def dot(d, cord=None):
@@ -107,59 +170,61 @@ def dot(d, cord=None):
     else:
         mw = cord[0]/2
         mh = cord[1]/2
+    s = FrameScheduler(d)
     for i in range(0, w):
         d.reset()
-        draw.ellipse([(mw-i, mh-i), (mw+i, mh+i)], fill=(255, 255, 255))
-        d.send()
-        time.sleep(0.6 / (i+1))
+        draw.ellipse([(mw-i, mh-i), (mw+i, mh+i)], fill=d.ink())
+        s.send(hold=0.6 / (i+1))
+    s.finish()
     del draw
 
 
 def wipe_horizontal(d, direction=1, white=False):
     w, h = d.im.size
+    s = FrameScheduler(d, fps=1/0.07)
     d.reset(white=~white)
-    d.send()
-    time.sleep(0.5)
+    s.send(hold=0.5, drop=False)
     start = 1 if direction >= 0 else w
-    fill = (255,255,255) if white else (0,0,0)
+    fill = d.ink(white)
     for x in range(start, w+1, direction):
         draw = ImageDraw.Draw(d.im)
         xy = (0, 0)
         sz = (x, h)
         draw.rectangle([xy, sz], fill=fill)
         del draw
-        d.send()
-        time.sleep(0.07)
+        s.send()
+    s.finish()
 
 
 def wipe_vertical(d, direction=1, white=True):
     w, h = d.im.size
+    s = FrameScheduler(d, fps=10)
     d.reset(white=~white)
-    d.send()
-    time.sleep(0.5)
+    s.send(hold=0.5, drop=False)
     start = 1 if direction >= 0 else h
-    fill = (255,255,255) if white else (0,0,0)
+    fill = d.ink(white)
     for y in range(start, h+1, direction):
         draw = ImageDraw.Draw(d.im)
         xy = (0, 0)
         sz = (w, y)
         draw.rectangle([xy, sz], fill=fill)
         del draw
-        d.send()
-        time.sleep(0.1)
+        s.send()
+    s.finish()
 
 
 def curtain(d):
     w, h = d.im.size
+    s = FrameScheduler(d, fps=10)
     for x in range(1, w+1):
         draw = ImageDraw.Draw(d.im)
         xy = (w-x, 0)
         sz = (x, h)
-        draw.rectangle([(0, 0), (w, h)], fill=(255, 255, 255))
-        draw.rectangle([xy, sz], fill=(0, 0, 0))
+        draw.rectangle([(0, 0), (w, h)], fill=d.ink())
+        draw.rectangle([xy, sz], fill=d.ink(False))
         del draw
-        d.send()
-        time.sleep(0.1)
+        s.send()
+    s.finish()
 
 
 transitions = [
@@ -171,12 +236,19 @@ transitions = [
     wipe_vertical,
     gobble,
     ]
-random.shuffle(transitions)
-t_idx = 0
+# shuffled on first use
+t_idx = None
 
 
-def rand(d):
+def next_transition():
     global t_idx
+    if t_idx is None:
+        random.shuffle(transitions)
+        t_idx = 0
     f = transitions[t_idx]
     t_idx = (t_idx + 1) % len(transitions)
-    f(d)
+    return f
+
+
+def rand(d):
+    next_transition()(d)
@@ -2,6 +2,8 @@
 #
 # module level symbols for flipdot
 
-from .client import Client, UDPClient, SerialClient
+from .client import Client, UDPClient, SerialClient, BusShaper
+from .client import AsyncClient, AsyncUDPClient, AsyncTCPClient, AsyncSerialClient
 from .display import Display
 from .panel import Panel
+from .scheduler import FrameScheduler
@@ -3,10 +3,12 @@
 import sys
 import time
 
-from demo import animations
 from flipdot import client, display
 import argparse
 
+# demo animations, their assets and the transition cache are only imported
+# when first used so that showing plain text starts quickly
+
 parser = argparse.ArgumentParser(description='Run an Alfa-Zeta flot-dot client')
 parser.add_argument('-P','--protocol', type=str, choices=['tcp', 'udp', 'usb'],
                     default='udp',
@@ -30,30 +32,42 @@ parser.add_argument('--portrait', action='store_true',
                     help='panels are in portrait orientation')
 parser.add_argument('--blink', action='store_true',
                     help='blink text')
+parser.add_argument('--sync', action='store_true',
+                    help='latch all panels at once with a broadcast refresh')
+parser.add_argument('--cache', type=str, default=None,
+                    help='directory to keep compiled transitions in')
+parser.add_argument('--preload', action='store_true',
+                    help='load all demo images and fonts at start rather than on first use')
 parser.add_argument('--stdout', action='store_true',
                     help='print display config')
 # TODO - add log output
 parser.add_argument('-v','--verbose', action='store_true',
                     help='enabling verbose debugging output')
-args = parser.parse_args()
 
 PANEL_X = 28
 PANEL_Y = 7
 
 CLIENT_TYPE = {
-        'udp': ((args.ip, args.port), client.UDPClient),
-        'tcp': ((args.ip, args.port), client.TCPClient),
-        'usb': (args.usb, client.SerialClient)
+        'udp': lambda args: client.UDPClient(args.ip, args.port),
+        'tcp': lambda args: client.TCPClient(args.ip, args.port),
+        'usb': lambda args: client.SerialClient(args.usb)
 }
 
-
-d = display.Display(args.width, args.height, display.create_display((PANEL_X, PANEL_Y), (args.width, args.height)))
-if args.stdout: print(d.panels)
+# transitions are compiled to panel bytes once and replayed from then on,
+# kept in cache_dir (set by main) if given
+cache_dir = None
+transitions = None
 
 def transition(d):
-    animations.rand(d)
+    global transitions
+    from demo import animations
+    if transitions is None:
+        from flipdot import sequence
+        transitions = sequence.SequenceCache(cache_dir)
+    transitions.play(d, animations.next_transition())
 
 def mainloop(d):
+    from demo import animations
     animations.display_text(d, "YO!")
     time.sleep(2)
     transition(d)
@@ -66,11 +80,19 @@ def mainloop(d):
     d.reset()
     d.send()
 
-def main():
-    if args.protocol == 'usb':
-        d.connect(CLIENT_TYPE[args.protocol][1](CLIENT_TYPE[args.protocol][0]))
-    else:
-        d.connect(CLIENT_TYPE[args.protocol][1](*CLIENT_TYPE[args.protocol][0]))
+def main(argv=None):
+    global cache_dir
+    args = parser.parse_args(argv)
+    cache_dir = args.cache
+
+    from demo import animations
+    if args.preload:
+        animations.preload()
+
+    d = display.Display(args.width, args.height, display.create_display((PANEL_X, PANEL_Y), (args.width, args.height)), sync=args.sync)
+    if args.stdout: print(d.panels)
+
+    d.connect(CLIENT_TYPE[args.protocol](args))
     try:
         d.reset(white=True)
         while True:
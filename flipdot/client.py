@@ -3,25 +3,281 @@
 # client.py -- client driver for Flipdot display
 # supports both a UDP simulator, as well as a serial
 # connected device
+#
+# asyncio and pyserial are only imported by the clients that use them so
+# that a plain UDP or TCP client starts quickly
 
+import collections
 import socket
-
-import serial
+import struct
+import threading
+import time
 
 CHAN_TCP, CHAN_UDP, CHAN_SERIAL = range(3)
 
+# address all panels on the bus
+BROADCAST = 0xFF
+
+# simulator only command carrying the send time (little endian double) so
+# it can measure latency, real gateways don't know it
+TIMESTAMP = 0xFE
+
+
+# data length -> (refresh, no refresh) command
+COMMANDS = {
+    112: (0x82, 0x81),
+    28: (0x83, 0x84),
+    56: (0x85, 0x86),
+}
+
+
+# bits on the RS485 wire per byte with 8N1 framing
+BITS_PER_BYTE = 10
+
+
+class BusShaper(object):
+    """
+    Models the RS485 bus downstream of a client at its baud rate, pacing
+    writes so that no more than a buffer's worth of bytes is ever waiting to
+    go out on the bus, and measuring how busy the bus is.
+    """
+
+    def __init__(self, baudrate=57600, buffer=128, window=1.0, clock=None, sleep=None):
+        """
+        Keyword arguments:
+        baudrate -- bus baud rate
+        buffer -- bytes the gateway (or serial driver) can hold waiting for
+        the bus, writes are batched and paced to stay within it
+        window -- seconds over which utilisation is measured
+        clock -- monotonic time source in seconds, time.monotonic by default
+        sleep -- sleep function, time.sleep by default
+        """
+        self.rate = baudrate / BITS_PER_BYTE
+        self.buffer = buffer
+        self.window = window
+        self.clock = clock or time.monotonic
+        self.sleep = sleep or time.sleep
+        # time at which the bus will have drained everything written
+        self.free_at = 0.0
+        # (start, end) of bus transmissions within the window
+        self.busy = collections.deque()
+        self.bytes = 0
+        self.waited = 0.0
+
+    def queued(self):
+        """
+        Bytes written but not yet out on the bus
+        """
+        return max(0.0, self.free_at - self.clock()) * self.rate
+
+    def batches(self, ends):
+        """
+        Group consecutive messages, given by their end offsets in a batch
+        buffer, into (first, last + 1) index ranges that fit the buffer,
+        always at least one message per range
+        """
+        return spans(ends, self.buffer)
+
+    def wait(self, n):
+        """
+        Block until n bytes can be written without oversubscribing the bus,
+        then account for them
+        """
+        room = self.buffer - n
+        over = self.queued() - max(room, 0)
+        if over > 0:
+            self.sleep(over / self.rate)
+            self.waited += over / self.rate
+        now = self.clock()
+        start = max(now, self.free_at)
+        self.free_at = start + n / self.rate
+        self.busy.append((start, self.free_at))
+        self.bytes += n
+        self.prune(now)
+
+    def prune(self, now):
+        """
+        Forget transmissions that ended before the window, so the history
+        stays bounded however long the client runs
+        """
+        since = now - self.window
+        while self.busy and self.busy[0][1] <= since:
+            self.busy.popleft()
+
+    @property
+    def utilisation(self):
+        """
+        Fraction of the last window the bus spent transmitting
+        """
+        now = self.clock()
+        since = now - self.window
+        self.prune(now)
+        busy = sum(min(end, now) - max(start, since)
+                   for start, end in self.busy if start < now)
+        return busy / self.window
+
+    def max_fps(self, data_lengths):
+        """
+        Frames per second the bus can carry for panels with the given data
+        lengths (28, 56 or 112), eg. to size walls per gateway
+        """
+        return self.rate / sum(n + 4 for n in data_lengths)
+
+
+def spans(ends, limit=None):
+    """
+    Group consecutive messages, given by their end offsets in a batch buffer,
+    into (first, last + 1) index ranges of up to limit bytes, or one message
+    per range if limit is None. A message bigger than limit gets a range of
+    its own.
+    """
+    first = 0
+    for i in range(1, len(ends)):
+        start = ends[first - 1] if first else 0
+        if limit is None or ends[i] - start > limit:
+            yield first, i
+            first = i
+    if first < len(ends):
+        yield first, len(ends)
+
+
+def datagrams(ends, mtu=None):
+    """
+    Pack formatted messages, given by their end offsets in a batch buffer,
+    into (start, end) byte ranges of up to mtu bytes, or one message per
+    datagram if mtu is None
+    """
+    for i, j in spans(ends, mtu):
+        yield (ends[i - 1] if i else 0), ends[j - 1]
+
 
 class Client(object):
 
+    # format every batch into the same buffer, see batch_buffer
+    reuse_batch = True
+
+    def __init__(self, shaper=None):
+        # (screen_id, length, refresh) -> (message buffer, view of its data)
+        self.buffers = {}
+        # (screen_id, length, refresh) -> message header
+        self.headers = {}
+        # batch buffer reused by every send and the layout of the last batch
+        # formatted into it, see format_batch
+        self.batch = bytearray(1024)
+        self.layout = None
+        self.view = None
+        self.starts = []
+        self.ends = []
+        # optional BusShaper pacing writes to the bus rate
+        self.shaper = shaper
+        # end each batch with a TIMESTAMP frame, for the simulator only
+        self.timestamps = False
+        # held from formatting a batch until it is written
+        self.lock = threading.Lock()
+
+    def header(self, screen_id, length, refresh):
+        """
+        Start byte, command and address of a panel message
+        """
+        key = (screen_id, length, refresh)
+        try:
+            return self.headers[key]
+        except KeyError:
+            if length not in COMMANDS:
+                raise ValueError('Unsupported data length {}, should be one of {}'.format(
+                    length, sorted(COMMANDS)))
+            head = bytes([0x80, COMMANDS[length][0 if refresh else 1], screen_id])
+            self.headers[key] = head
+            return head
+
     def format_message(self, screen_id, data, refresh):
-        dl = len(data)
-        if dl == 112:
-            msg = 0x82 if refresh else 0x81
-        elif dl == 28:
-            msg = 0x83 if refresh else 0x84
-        elif dl == 56:
-            msg = 0x85 if refresh else 0x86
-        return bytearray([0x80, msg, screen_id]) + data + bytearray([0x8F])
+        """
+        Format a single panel message into a buffer preallocated with the
+        header and end byte for this panel, length and refresh, so only the
+        data is copied. The returned buffer is shared: the next call for the
+        same panel, length and refresh overwrites it, so copy it if it needs
+        to be kept. Sends don't use it, see format_batch.
+        """
+        key = (screen_id, len(data), refresh)
+        try:
+            buf, view = self.buffers[key]
+        except KeyError:
+            buf = bytearray(self.header(*key)) + bytearray(len(data)) + bytearray([0x8F])
+            view = memoryview(buf)[3:-1]
+            self.buffers[key] = (buf, view)
+        view[:] = data
+        return buf
+
+    def format_latch(self):
+        """
+        Broadcast refresh with no data, shows data previously sent to each
+        panel with a no refresh command
+        """
+        return bytearray([0x80, 0x82, BROADCAST, 0x8F])
+
+    def format_timestamp(self):
+        """
+        TIMESTAMP frame with the current time.time()
+        """
+        return bytearray([0x80, TIMESTAMP, BROADCAST]) + struct.pack('<d', time.time()) + b'\x8F'
+
+    def batch_buffer(self, n):
+        """
+        View of n bytes to format a batch into
+        """
+        if not self.reuse_batch:
+            return memoryview(bytearray(n))
+        if len(self.batch) < n:
+            self.batch = bytearray(max(n, 2 * len(self.batch)))
+        return memoryview(self.batch)[:n]
+
+    def format_batch(self, frames, latch=False):
+        """
+        Format a batch of messages back to back into one preallocated buffer
+        so the data is copied once and the buffer is written as it is. The
+        buffer is reused, and when a batch is for the same panels, lengths
+        and commands as the last one its headers and end bytes are already
+        in place so only the data is copied. Hold self.lock until the batch
+        is written.
+
+        Keyword arguments:
+        frames -- list of (screen_id, data, refresh)
+        latch -- follow the frames with a broadcast latch
+
+        Returns (view, ends): a memoryview of the batch and the end offset of
+        each message in it
+        """
+        stamp = bool(self.timestamps and (frames or latch))
+        layout = ([(f[0], len(f[1]), f[2]) for f in frames], latch, stamp)
+        if not self.reuse_batch or layout != self.layout:
+            # forget the old layout first in case a bad frame raises midway
+            self.layout = None
+            keys = layout[0]
+            n = sum(k[1] for k in keys) + 4 * len(keys) + (4 if latch else 0) + (12 if stamp else 0)
+            view = self.batch_buffer(n)
+            starts, ends = [], []
+            o = 0
+            for k in keys:
+                end = o + k[1] + 4
+                view[o:o + 3] = self.header(*k)
+                view[end - 1] = 0x8F
+                starts.append(o + 3)
+                ends.append(end)
+                o = end
+            if latch:
+                view[o:o + 4] = self.format_latch()
+                o += 4
+                ends.append(o)
+            if stamp:
+                ends.append(o + 12)
+            self.view, self.starts, self.ends = view, starts, ends
+            self.layout = layout if self.reuse_batch else None
+        view = self.view
+        for start, f in zip(self.starts, frames):
+            view[start:start + len(f[1])] = f[1]
+        if stamp:
+            view[-12:] = self.format_timestamp()
+        return view, self.ends
 
     def open(self):
         raise NotImplementedError
@@ -29,13 +285,67 @@ class Client(object):
     def close(self):
         raise NotImplementedError
 
-    def send(self, screen_id, data, refresh=True):
+    def write(self, b):
         raise NotImplementedError
 
+    def write_many(self, view, ends):
+        """
+        Write formatted messages, given as a buffer and the end offset of each
+        message in it, paced by the shaper if there is one
+        """
+        if not self.shaper:
+            self.write_batch(view, ends)
+            return
+        for i, j in self.shaper.batches(ends):
+            start = ends[i - 1] if i else 0
+            self.shaper.wait(ends[j - 1] - start)
+            self.write_batch(view[start:ends[j - 1]], [e - start for e in ends[i:j]])
+
+    def write_batch(self, view, ends):
+        """
+        Write formatted messages as one contiguous buffer
+        """
+        self.write(view)
+
+    def send(self, screen_id, data, refresh=True):
+        self.send_many([(screen_id, data, refresh)])
+
+    def send_many(self, frames, latch=False):
+        """
+        Send a batch of frames with a single transport write
+
+        Keyword arguments:
+        frames -- iterable of (screen_id, data, refresh)
+        latch -- follow the frames with a broadcast latch
+        """
+        if not isinstance(frames, list):
+            frames = list(frames)
+        if not frames and not latch:
+            return
+        with self.lock:
+            view, ends = self.format_batch(frames, latch)
+            self.write_many(view, ends)
+
+    def latch(self):
+        """
+        Refresh all panels at once
+        """
+        self.send_many([], latch=True)
+
 
 class UDPClient(Client):
-    def __init__(self, host, port):
+    def __init__(self, host, port, mtu=None, shaper=None):
+        """
+        Keyword arguments:
+        host -- address of Ethernet->RS485 device
+        port -- port of Ethernet->RS485 device
+        mtu -- if set, pack batched frames into datagrams of up to this many
+        bytes. Leave as None for gateways that expect one frame per datagram.
+        shaper -- BusShaper for the RS485 bus behind the device
+        """
+        super(UDPClient, self).__init__(shaper)
         self.addr = (host, port)
+        self.mtu = mtu
         self.kind = CHAN_UDP
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
@@ -45,12 +355,16 @@ class UDPClient(Client):
     def close(self):
         self.sock.close()
 
-    def send(self, screen_id, data, refresh=True):
-        b = self.format_message(screen_id, data, refresh)
+    def write(self, b):
         self.sock.sendall(b)
 
+    def write_batch(self, view, ends):
+        for start, end in datagrams(ends, self.mtu):
+            self.write(view[start:end])
+
 class TCPClient(Client):
-    def __init__(self, host, port):
+    def __init__(self, host, port, shaper=None):
+        super(TCPClient, self).__init__(shaper)
         self.addr = (host, port)
         self.kind = CHAN_TCP
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -62,15 +376,16 @@ class TCPClient(Client):
     def close(self):
         self.sock.close()
 
-    def send(self, screen_id, data, refresh=True):
-        b = self.format_message(screen_id, data, refresh)
-        self.sock.send(b)
+    def write(self, b):
+        self.sock.sendall(b)
 
 class SerialClient(Client):
-    def __init__(self, port):
+    def __init__(self, port, baudrate=57600, shaper=None):
+        super(SerialClient, self).__init__(shaper)
+        import serial
         self.kind = CHAN_SERIAL
         self.chan = serial.Serial()
-        self.chan.baudrate = 57600
+        self.chan.baudrate = baudrate
         self.chan.port = port
 
     def open(self):
@@ -79,6 +394,112 @@ class SerialClient(Client):
     def close(self):
         self.chan.close()
 
-    def send(self, screen_id, data, refresh=True):
-        b = self.format_message(screen_id, data, refresh)
+    def write(self, b):
         self.chan.write(b)
+
+
+#
+# asyncio clients: open, close and drain are coroutines while send, send_many
+# and latch only queue data on the transport so never block the event loop
+#
+
+class AsyncClient(Client):
+
+    # transports may hold on to unsent data, so every batch gets a buffer of
+    # its own rather than being copied on write
+    reuse_batch = False
+
+    def __init__(self):
+        super(AsyncClient, self).__init__()
+        self.transport = None
+
+    async def open(self):
+        raise NotImplementedError
+
+    async def close(self):
+        if self.transport:
+            self.transport.close()
+        self.transport = None
+
+    async def drain(self):
+        """
+        Wait until the transport can take more data
+        """
+        pass
+
+    def write(self, b):
+        self.transport.write(b)
+
+
+class AsyncUDPClient(AsyncClient):
+    def __init__(self, host, port, mtu=None):
+        """
+        Keyword arguments as UDPClient
+        """
+        super(AsyncUDPClient, self).__init__()
+        self.addr = (host, port)
+        self.mtu = mtu
+        self.kind = CHAN_UDP
+
+    async def open(self):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            asyncio.DatagramProtocol, remote_addr=self.addr)
+
+    def write(self, b):
+        self.transport.sendto(b)
+
+    def write_batch(self, view, ends):
+        for start, end in datagrams(ends, self.mtu):
+            self.write(view[start:end])
+
+
+class AsyncTCPClient(AsyncClient):
+    def __init__(self, host, port):
+        super(AsyncTCPClient, self).__init__()
+        self.addr = (host, port)
+        self.kind = CHAN_TCP
+        self.writer = None
+
+    async def open(self):
+        import asyncio
+        _, self.writer = await asyncio.open_connection(*self.addr)
+        self.transport = self.writer.transport
+
+    async def close(self):
+        if self.writer:
+            self.writer.close()
+            await self.writer.wait_closed()
+        self.writer = None
+        self.transport = None
+
+    async def drain(self):
+        await self.writer.drain()
+
+
+class AsyncSerialClient(AsyncClient):
+    def __init__(self, port, baudrate=57600):
+        """
+        Requires the pyserial-asyncio package
+        """
+        super(AsyncSerialClient, self).__init__()
+        self.kind = CHAN_SERIAL
+        self.port = port
+        self.baudrate = baudrate
+        self.writer = None
+
+    async def open(self):
+        import serial_asyncio
+        _, self.writer = await serial_asyncio.open_serial_connection(
+            url=self.port, baudrate=self.baudrate)
+        self.transport = self.writer.transport
+
+    async def close(self):
+        if self.writer:
+            self.writer.close()
+        self.writer = None
+        self.transport = None
+
+    async def drain(self):
+        await self.writer.drain()
@@ -3,8 +3,213 @@
 # display.py
 
 from __future__ import print_function
+import time
+
+from operator import itemgetter
+
 from PIL import Image, ImageDraw
 from flipdot import client as c
+from flipdot.record import Recorder
+from flipdot.sender import BackgroundSender
+
+# translate tables mapping a thresholded pixel (0 if unlit) to its bit in
+# the column byte for each row of a panel, row 0 being the least significant
+# bit
+_ROW_BITS = [bytes([0]) + bytes([1 << y]) * 255 for y in range(8)]
+
+# translate table thresholding single band pixels, lit at the same level as
+# an RGB pixel with equal channels
+_LIT = bytes(1 if 3 * v > 400 else 0 for v in range(256))
+
+# RGB to L matrix giving the rounded mean of the channels, r + g + b > 400
+# exactly when the mean rounds to 134 or more
+_MEAN = (1 / 3, 1 / 3, 1 / 3, 0)
+_MEAN_LIT = bytes(1 if v >= 134 else 0 for v in range(256))
+
+# supported backing image modes
+MODES = ("RGB", "L", "1")
+
+
+def threshold(im):
+    """
+    Threshold a whole image in one pass, returning one byte per pixel (0 if
+    unlit, non zero if lit) in row major order. Matches Display.px_to_bit.
+    """
+    if im.mode == "1":
+        # already thresholded, unpacked straight to 0 or 255 bytes
+        return im.tobytes("raw", "L")
+    if im.mode != "RGB":
+        if im.mode != "L":
+            im = im.convert("L")
+        return im.tobytes().translate(_LIT)
+    # a matrix convert costs far less than ImageMath to set up, which
+    # matters when thresholding a single panel
+    return im.convert("L", _MEAN).tobytes().translate(_MEAN_LIT)
+
+
+def ink(mode, white=True):
+    """
+    Fill colour of lit (white) or unlit dots for an image mode
+    """
+    if mode == "RGB":
+        return (255, 255, 255) if white else (0, 0, 0)
+    return 255 if white else 0
+
+
+def pack_rows(bits, stride, y, h):
+    """
+    Pack a band of h rows starting at row y of thresholded bits into one
+    column byte per image column. Each row is mapped to its bit with a
+    translate and the rows are merged as big ints so that no per pixel Python
+    work is done.
+
+    Keyword arguments:
+    bits -- thresholded image bytes from threshold()
+    stride -- width of the image the bits came from
+    y -- first row of band
+    h -- height of band (panel height)
+    """
+    if h != 7:
+        print("H is not 7!!!!")
+    col = 0
+    for r in range(h):
+        start = (y + r) * stride
+        col |= int.from_bytes(bits[start:start + stride].translate(_ROW_BITS[r]), 'big')
+    return col.to_bytes(stride, 'big')
+
+
+def pack_panels(bits, stride, panels):
+    """
+    Pack all panels from thresholded bits in one pass, packing each band of
+    panel rows once and slicing the panel columns out of it.
+
+    Keyword arguments:
+    bits -- thresholded image bytes from threshold()
+    stride -- width of the image the bits came from
+    panels -- dict of address -> ((x, y), (w, h))
+    """
+    bands = {}
+    ret = {}
+    for address, panel in panels.items():
+        (xs, ys), (w, h) = panel[:2]
+        if (ys, h) not in bands:
+            bands[(ys, h)] = pack_rows(bits, stride, ys, h)
+        ret[address] = bytearray(bands[(ys, h)][xs:xs + w])
+    return ret
+
+
+def orient(c, r, w, h, rotate=0, mirror=False):
+    """
+    Position of dot (c, r) of a w x h panel (or display) within the image
+    region it covers when mounted rotated by rotate degrees (0, 90, 180 or
+    270, counter clockwise as PIL Image.rotate) and optionally mirrored
+    left to right. The region is h x w when rotated by 90 or 270.
+    """
+    if mirror:
+        c = w - 1 - c
+    if rotate == 0:
+        return c, r
+    elif rotate == 90:
+        return h - 1 - r, c
+    elif rotate == 180:
+        return w - 1 - c, h - 1 - r
+    elif rotate == 270:
+        return r, w - 1 - c
+    raise ValueError('Unsupported rotation {}, should be 0, 90, 180 or 270'.format(rotate))
+
+
+def footprint(size, rotate=0):
+    """
+    Size of the image region covered by a panel or display of size (w, h)
+    when mounted rotated by rotate degrees
+    """
+    return size[::-1] if rotate in (90, 270) else tuple(size)
+
+
+def panel_orientation(panel):
+    """
+    Split a panel entry ((x, y), (w, h)[, rotate[, mirror]]) into its
+    position, size, rotation and mirroring
+    """
+    xy, sz = panel[:2]
+    rotate = panel[2] if len(panel) > 2 else 0
+    mirror = panel[3] if len(panel) > 3 else False
+    return xy, sz, rotate, mirror
+
+
+def compile_maps(panels, stride, size=None, origin=(0, 0), rotate=0, mirror=False):
+    """
+    Compile the geometry of panels into maps of image pixel indices so they
+    can be packed straight from thresholded image bits with no intermediate
+    images. Panels of the same height are grouped so that all of the group is
+    gathered in one go, row after row, returns a list of groups:
+    (width, height, gatherer, {address: (column offset, w)})
+
+    Keyword arguments:
+    panels -- dict of address -> ((x, y), (w, h)[, rotate[, mirror]])
+    stride -- width of the image the panels are packed from
+    size -- (w, h) of the display holding the panels, needed if it is rotated
+    or mirrored within the image
+    origin -- (x, y) of the display within the image
+    rotate -- rotation of the display within the image, see orient()
+    mirror -- display is mirrored within the image
+    """
+    groups = {}
+    for address, panel in panels.items():
+        h = panel[1][1]
+        rows, slices = groups.setdefault(h, ([[] for _ in range(h)], {}))
+        slices[address] = (len(rows[0]), panel[1][0])
+        for r, row in enumerate(panel_rows(panel, stride, size, origin, rotate, mirror)):
+            rows[r].extend(row)
+    return [(len(rows[0]), len(rows), _gatherer([i for row in rows for i in row]), slices)
+            for rows, slices in groups.values()]
+
+
+def panel_rows(panel, stride, size=None, origin=(0, 0), rotate=0, mirror=False):
+    """
+    Image pixel indices of the dots of a panel, a list of rows of indices
+    from column 0. Arguments as compile_maps, for a single panel entry.
+    """
+    (xs, ys), (w, h), prot, pmirror = panel_orientation(panel)
+    rows = []
+    for r in range(h):
+        row = []
+        for c in range(w):
+            px, py = orient(c, r, w, h, prot, pmirror)
+            x, y = xs + px, ys + py
+            if rotate or mirror:
+                x, y = orient(x, y, size[0], size[1], rotate, mirror)
+            row.append((origin[1] + y) * stride + origin[0] + x)
+        rows.append(row)
+    return rows
+
+
+def _gatherer(indices):
+    """
+    itemgetter for indices, returning a tuple even for a single index
+    """
+    if len(indices) == 1:
+        i = indices[0]
+        return lambda b: (b[i],)
+    return itemgetter(*indices)
+
+
+def pack_maps(bits, maps):
+    """
+    Pack panels from thresholded bits using maps from compile_maps
+    """
+    ret = {}
+    for w, h, gather, slices in maps:
+        if h != 7:
+            print("H is not 7!!!!")
+        group = bytes(gather(bits))
+        col = 0
+        for r in range(h):
+            col |= int.from_bytes(group[r * w:(r + 1) * w].translate(_ROW_BITS[r]), 'big')
+        data = col.to_bytes(w, 'big')
+        for address, (offset, pw) in slices.items():
+            ret[address] = bytearray(data[offset:offset + pw])
+    return ret
 
 
 def create_display(panel_size: tuple, display_size: tuple):
@@ -32,22 +237,47 @@ def create_display(panel_size: tuple, display_size: tuple):
 
 class Display(object):
 
-    def __init__(self, w, h, panels=None):
+    def __init__(self, w, h, panels=None, sync=False, mode="RGB"):
         """
         Construct a display of given width and height, with the given ID.
-        Note that we use and RGB backing image since some PIL implementations
-        don't seem to support 1-bit (mode "1") images well.
+        Note that we use and RGB backing image by default since some PIL
+        implementations don't seem to support 1-bit (mode "1") images well.
+        Where they do, mode "1" (or "L") uses a single band backing image so
+        clears, pastes and packing move one byte per dot rather than RGB
+        pixels. Use ink() for fill colours that suit the mode.
 
         'panels' is a dictionary mapping:
         address (int) -> ((x, y), (w, h))
 
+        or for panels mounted rotated (0, 90, 180 or 270 degrees counter
+        clockwise) and/or mirrored:
+        address (int) -> ((x, y), (w, h), rotate, mirror)
+
+        where (w, h) is the panel size before rotation. The panel geometry
+        is compiled into pixel maps on the first send, call compile() if
+        panels are changed after that.
+
         If panels is empty, a default mapping of address 1 to the whole
         display is used.
 
         Only rectangular panel combinations are allowed.
+
+        If sync is set, send writes all panels without refresh then latches
+        them with a single broadcast refresh so the whole display flips at once.
         """
         self.client = None
-        self.im = Image.new("RGB", (w, h))
+        self.sender = None
+        self.recorder = None
+        self.sync = sync
+        if mode not in MODES:
+            raise ValueError('Unsupported image mode {}, should be one of {}'.format(mode, MODES))
+        self.im = Image.new(mode, (w, h))
+        # address -> (bytes, refresh) last sent, used to skip unchanged panels
+        self.sent = {}
+        self.skipped = 0
+        self.maps = None
+        # address -> maps of a single panel, for to_bytes
+        self.panel_maps = {}
 
         if panels:
             self.panels = panels
@@ -62,14 +292,36 @@ class Display(object):
         """
         self.client = client
         self.client.open()
+        self.sent = {}
 
     def disconnect(self):
         """
         Disconnect the client from this display
         """
+        try:
+            self.stop_sender()
+        finally:
+            if self.client:
+                self.client.close()
+            self.client = None
+            self.sent = {}
+
+    async def connect_async(self, client: object):
+        """
+        Connect a display to an async client
+        """
+        self.client = client
+        await self.client.open()
+        self.sent = {}
+
+    async def disconnect_async(self):
+        """
+        Disconnect the async client from this display
+        """
         if self.client:
-            self.client.close()
+            await self.client.close()
         self.client = None
+        self.sent = {}
 
     def reset(self, address=None, white=False):
         """
@@ -78,34 +330,176 @@ class Display(object):
         """
         draw = ImageDraw.Draw(self.im)
         if address:
-            xy, sz = self.panels[address]
+            xy, sz = self.panels[address][:2]
         else:
             xy, sz = (0, 0), self.im.size
-        c = (255, 255, 255) if white else (0, 0, 0)
-        draw.rectangle([xy, sz], fill=c)
+        draw.rectangle([xy, sz], fill=self.ink(white))
         del draw
 
-    def send(self, refresh=True):
-        if not self.client:
-            return
-        for address in self.panels.keys():
-            self.client.send(address, self.to_bytes(address), refresh)
+    def ink(self, white=True):
+        """
+        Fill colour for drawing lit (white) or unlit dots in the backing image
+        """
+        return ink(self.im.mode, white)
+
+    def send(self, refresh=True, force=False, sync=None, packed=None):
+        """
+        Send each panel whose bytes differ from those last sent to it. Panels
+        already showing the same data are skipped unless force is set.
+
+        Keyword arguments:
+        refresh -- show the data once received
+        force -- send all panels even if unchanged
+        sync -- override self.sync: write panels without refresh then
+        broadcast a single latch
+        packed -- panel bytes to send instead of packing self.im, as
+        returned by pack()
+
+        Returns the number of panels skipped, also kept in self.skipped. With
+        a background sender the frame is only queued and 0 is returned, see
+        self.sender for counters.
+        """
+        self.skipped = 0
+        if not self.client and not self.recorder:
+            return 0
+        if packed is None:
+            packed = self.pack()
+        if self.sender:
+            self.sender.publish(packed, refresh, force, sync)
+            return 0
+        return self.transmit(packed, refresh, force, sync)
+
+    def start_sender(self):
+        """
+        Send from a background thread: send() packs the frame and returns
+        straight away, a frame not yet sent when the next is ready is dropped
+        """
+        if not self.sender:
+            self.sender = BackgroundSender(self)
+            self.sender.start()
+        return self.sender
+
+    def stop_sender(self):
+        """
+        Send any waiting frame and stop the background sender
+        """
+        sender, self.sender = self.sender, None
+        if sender:
+            sender.stop()
+
+    def start_recording(self, path, delta=True):
+        """
+        Record every frame transmitted from now on to path, see
+        flipdot.record. Works with or without a client connected. The next
+        send writes all panels so the recording starts from a full frame.
+
+        Keyword arguments:
+        delta -- store panel data as changes where that is smaller
+        """
+        self.stop_recording()
+        self.recorder = Recorder(path, self.im.size, self.panels, delta=delta,
+                                 clock=getattr(self, 'clock', None))
+        self.sent = {}
+        return self.recorder
+
+    def stop_recording(self):
+        """
+        Finish and close the recording
+        """
+        try:
+            if self.sender:
+                self.sender.flush()
+        finally:
+            if self.recorder:
+                self.recorder.close()
+            self.recorder = None
+
+    async def send_async(self, refresh=True, force=False, sync=None, packed=None):
+        """
+        As send but for an async client, waiting for the client transport to
+        drain rather than blocking on the write
+        """
+        self.skipped = 0
+        if not self.client and not self.recorder:
+            return 0
+        if packed is None:
+            packed = self.pack()
+        self.transmit(packed, refresh, force, sync)
+        if self.client:
+            await self.client.drain()
+        return self.skipped
+
+    def transmit(self, packed, refresh=True, force=False, sync=None):
+        """
+        Write packed panel data to the client in one batch, skipping panels
+        that would not change
+
+        Keyword arguments:
+        packed -- dict of address -> column bytes, as returned by pack()
+        """
+        sync = self.sync if sync is None else sync
+        frames = []
+        for address, data in packed.items():
+            if not force and self.unchanged(address, data, refresh):
+                self.skipped += 1
+                continue
+            frames.append((address, data, refresh and not sync))
+        if frames:
+            if self.client:
+                self.client.send_many(frames, latch=sync and refresh)
+            if self.recorder:
+                self.recorder.write(frames, latch=sync and refresh)
+            for address, data, _ in frames:
+                self.sent[address] = (data, refresh)
+        return self.skipped
+
+    def unchanged(self, address, data, refresh=True):
+        """
+        True if sending data to address would not change the panel: the same
+        bytes were last sent and were either refreshed or this is not a
+        refresh either
+        """
+        last = self.sent.get(address)
+        return last is not None and last[0] == data and (last[1] or not refresh)
+
+    def pack(self):
+        """
+        Pack every panel from a single threshold of the backing image.
+        Returns dict of address -> column bytes
+        """
+        bits = threshold(self.im)
+        if all(len(p) == 2 for p in self.panels.values()):
+            return pack_panels(bits, self.im.size[0], self.panels)
+        if self.maps is None:
+            self.compile()
+        return pack_maps(bits, self.maps)
+
+    def compile(self):
+        """
+        Compile the panel geometry into pixel maps for packing
+        """
+        self.maps = compile_maps(self.panels, self.im.size[0])
+        self.panel_maps = {}
 
     def to_bytes(self, address):
-        px = self.im.load()
-        (xs, ys), (w, h) = self.panels[address]
-        result = bytearray()
-        for x in range(xs, xs + w):
-            if h != 7:
-                print("H is not 7!!!!")
-            b = 0
-            for y in range(h-1, -1, -1):
-                p = self.px_to_bit(px[x, ys + y])
-                b = (b << 1) | p
-            result.append(b)
-        return result
+        """
+        Pack a single panel, thresholding only the part of the image it
+        covers. Use pack() for all panels.
+        """
+        (xs, ys), (w, h), rotate, mirror = panel_orientation(self.panels[address])
+        fw, fh = footprint((w, h), rotate)
+        bits = threshold(self.im.crop((xs, ys, xs + fw, ys + fh)))
+        if not rotate and not mirror:
+            return bytearray(pack_rows(bits, w, 0, h))
+        maps = self.panel_maps.get(address)
+        if maps is None:
+            maps = compile_maps({address: ((0, 0), (w, h), rotate, mirror)}, fw)
+            self.panel_maps[address] = maps
+        return pack_maps(bits, maps)[address]
 
     def px_to_bit(self, px):
+        if isinstance(px, int):
+            return _LIT[px]
         (r, g, b) = px
         p = 1 if (r+g+b) > 400 else 0
         return p
@@ -117,7 +511,7 @@ class MultiDisplay(object):
     rendering via an inverse mux
     """
 
-    def __init__(self, w, h, displays: Display, portrait=False):
+    def __init__(self, w, h, displays: Display, portrait=False, parallel=False, mode="RGB"):
         """
         Construct a multi display of given width and height from supplied
         ordered displays.
@@ -129,11 +523,67 @@ class MultiDisplay(object):
         provided displays)
         displays -- dictionary of displays with key:
         ID -> ((x, y), Display))
-        portrait -- set true if 28x7 panels are in portrait configuration with displays
+        or for displays mounted rotated (0, 90, 180 or 270 degrees counter
+        clockwise) and/or mirrored within the image:
+        ID -> ((x, y), Display, rotate, mirror))
+        portrait -- set true if 28x7 panels are in portrait configuration with
+        displays, same as rotating every display by 90 with x, y swapped
+
+        Each display's geometry is compiled into pixel maps of this image on
+        the first send so panels are packed straight from it, call compile()
+        if displays change after that. split() is only needed to update the
+        images of the displays.
+        parallel -- send to each display from a thread pool, so a frame takes
+        as long as the slowest display rather than the sum of them all
+        mode -- backing image mode, as for Display
         """
-        self.im = Image.new("RGB", (w, h))
+        if mode not in MODES:
+            raise ValueError('Unsupported image mode {}, should be one of {}'.format(mode, MODES))
+        self.im = Image.new(mode, (w, h))
         self.displays = displays
         self.portrait = portrait
+        self.parallel = parallel
+        self.pool = None
+        self.skipped = 0
+        self.maps = None
+        # ID -> seconds taken by last send to each display
+        self.timings = {}
+
+    def orientation(self, dID):
+        """
+        Origin, rotation and mirroring of a display within the image
+        """
+        entry = self.displays[dID]
+        xy = entry[0]
+        if len(entry) > 2:
+            return xy, entry[2], entry[3] if len(entry) > 3 else False
+        if self.portrait:
+            return xy[::-1], 90, False
+        return xy, 0, False
+
+    def compile(self):
+        """
+        Compile the panel geometry of every display into pixel maps of the
+        image, covering display offset, rotation and mirroring as well as
+        that of each panel
+        """
+        stride = self.im.size[0]
+        self.maps = {}
+        for dID, entry in self.displays.items():
+            disp = entry[1]
+            origin, rotate, mirror = self.orientation(dID)
+            self.maps[dID] = compile_maps(disp.panels, stride, disp.im.size,
+                                          origin, rotate, mirror)
+
+    def pack(self):
+        """
+        Pack every panel of every display from a single threshold of the
+        image. Returns dict of ID -> address -> column bytes
+        """
+        if self.maps is None:
+            self.compile()
+        bits = threshold(self.im)
+        return {dID: pack_maps(bits, maps) for dID, maps in self.maps.items()}
 
     def connect(self, clients: dict):
         """
@@ -155,41 +605,114 @@ class MultiDisplay(object):
         """
         Disconnect all clients
         """
-        for _, disp in self.displays.values(): disp.disconnect()
+        for entry in self.displays.values(): entry[1].disconnect()
+        if self.pool:
+            self.pool.shutdown()
+        self.pool = None
+
+    async def connect_async(self, clients: dict):
+        """
+        Connect all displays to their async clients concurrently
+        """
+        if any(k not in clients for k in self.displays):
+            raise ValueError('No matching client for each display ID in supplied clients')
+        import asyncio
+        await asyncio.gather(*(entry[1].connect_async(clients[dID])
+                               for dID, entry in self.displays.items()))
+
+    async def disconnect_async(self):
+        """
+        Disconnect all async clients
+        """
+        import asyncio
+        await asyncio.gather(*(entry[1].disconnect_async() for entry in self.displays.values()))
 
-    def send(self, refresh=True):
+    def split(self):
         """
-        Divide the current image up and send to each display
+        Divide the current image up into the image of each display
         """
         for dID in self.displays:
-            xy, disp = self.displays[dID]
+            disp = self.displays[dID][1]
+            xy, rotate, mirror = self.orientation(dID)
 
             """
-            slice the main image up for portion of display, if the display is rotated, we swap the y, x ref
+            slice the main image up for portion of display, if the display is rotated, we swap the w, h
             panel 28x7 @ 0, 7:
             lanscape: 0, 7, 28, 7
             portrait: 7, 0, 7, 28
             this allows the main display image to be manipulated as it is displayed
             """
-            if self.portrait:
-                sz = (xy[1] + disp.im.size[1], xy[0] + disp.im.size[0])
-                xy = xy[::-1]
-            else:
-                sz = (xy[0] + disp.im.size[0], xy[1] + disp.im.size[1])
-
-            portion = self.im.crop(box=(xy[0], xy[1], sz[0], sz[1]))
-            if self.portrait: portion = portion.rotate(angle=90, expand=1)
+            sz = footprint(disp.im.size, rotate)
+            portion = self.im.crop(box=(xy[0], xy[1], xy[0] + sz[0], xy[1] + sz[1]))
+            if rotate: portion = portion.rotate(angle=rotate, expand=1)
+            if mirror: portion = portion.transpose(Image.FLIP_LEFT_RIGHT)
             disp.im.paste(portion)
-            disp.send(refresh=refresh)
             del portion
 
+    def send(self, refresh=True, force=False, sync=None, parallel=None):
+        """
+        Pack the current image for each display and send it. Returns the
+        total number of unchanged panels skipped, also kept in self.skipped
+
+        Keyword arguments:
+        parallel -- override self.parallel, send to all displays at once and
+        wait for every one to finish
+        """
+        packed = self.pack()
+        parallel = self.parallel if parallel is None else parallel
+
+        def timed(dID, disp):
+            start = time.perf_counter()
+            skipped = disp.send(refresh=refresh, force=force, sync=sync, packed=packed[dID])
+            self.timings[dID] = time.perf_counter() - start
+            return skipped
+
+        if parallel:
+            if not self.pool:
+                # imported on first use to keep startup quick
+                from concurrent.futures import ThreadPoolExecutor
+                self.pool = ThreadPoolExecutor(max_workers=len(self.displays))
+            futures = [self.pool.submit(timed, dID, entry[1])
+                       for dID, entry in self.displays.items()]
+            skipped = [f.result() for f in futures]
+        else:
+            skipped = [timed(dID, entry[1]) for dID, entry in self.displays.items()]
+        self.skipped = sum(skipped)
+        return self.skipped
+
+    async def send_async(self, refresh=True, force=False, sync=None):
+        """
+        Pack the current image for each display and send to all displays
+        concurrently using their async clients
+        """
+        packed = self.pack()
+
+        async def timed(dID, disp):
+            start = time.perf_counter()
+            skipped = await disp.send_async(refresh=refresh, force=force, sync=sync,
+                                            packed=packed[dID])
+            self.timings[dID] = time.perf_counter() - start
+            return skipped
+
+        import asyncio
+        skipped = await asyncio.gather(*(timed(dID, entry[1])
+                                         for dID, entry in self.displays.items()))
+        self.skipped = sum(skipped)
+        return self.skipped
+
     def reset(self, display=None, white=False):
         draw = ImageDraw.Draw(self.im)
         if display:
-            xy, disp = self.displays[display]
-            sz = (xy[0] + disp.im.size[0], xy[1] + disp.im.size[1])
+            xy, rotate, _ = self.orientation(display)
+            sz = footprint(self.displays[display][1].im.size, rotate)
+            sz = (xy[0] + sz[0], xy[1] + sz[1])
         else:
             xy, sz = (0, 0), self.im.size
-        c = (255,255,255) if white else (0, 0, 0)
-        draw.rectangle([xy, sz], fill=c)
+        draw.rectangle([xy, sz], fill=self.ink(white))
         del draw
+
+    def ink(self, white=True):
+        """
+        Fill colour for drawing lit (white) or unlit dots in the backing image
+        """
+        return ink(self.im.mode, white)
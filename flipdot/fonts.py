@@ -0,0 +1,237 @@
+#! /usr/bin/env python
+#
+# fonts.py -- bitmap fonts for dot matrix text
+#
+# Glyphs are stored as packed column bytes, bit 0 being the top row, the same
+# format as panel data from Display.to_bytes, so text can be composed
+# straight into panel data without rendering an image.
+
+from functools import lru_cache
+
+from flipdot.display import panel_orientation
+
+
+class BitmapFont(object):
+    """
+    A dot matrix font of column byte glyphs
+    """
+
+    def __init__(self, glyphs, height, spacing=1, proportional=False, default='?'):
+        """
+        Keyword arguments:
+        glyphs -- dict of char -> bytes, one byte per column
+        height -- rows used by the glyphs
+        spacing -- blank columns between glyphs
+        proportional -- trim blank columns either side of each glyph
+        default -- char used for chars without a glyph
+        """
+        self.glyphs = glyphs
+        self.height = height
+        self.spacing = spacing
+        self.proportional = proportional
+        self.default = default
+
+    def glyph(self, ch):
+        """
+        Column bytes of a single char
+        """
+        g = self.glyphs.get(ch)
+        if g is None:
+            g = self.glyphs.get(ch.upper(), self.glyphs[self.default])
+        if self.proportional and ch != ' ':
+            g = g.strip(b'\x00')
+        elif self.proportional:
+            g = g[:2]
+        return g
+
+    def columns(self, text):
+        """
+        Column bytes of text
+        """
+        gap = bytes(self.spacing)
+        return bytearray(gap.join(self.glyph(ch) for ch in text))
+
+    def width(self, text):
+        return len(self.columns(text))
+
+
+def _hex_glyphs(first, lines, width):
+    data = bytes.fromhex(''.join(lines))
+    return {chr(first + i // width): data[i:i + width] for i in range(0, len(data), width)}
+
+
+# ASCII 0x20 - 0x7E, 5 columns x 7 rows
+_5X7 = [
+    '0000000000 00005f0000 0007000700 147f147f14 242a7f2a12 2313086462 3649552250 0005030000'  #  !"#$%&'
+    '001c224100 0041221c00 082a1c2a08 08083e0808 0050300000 0808080808 0060600000 2010080402'  # ()*+,-./
+    '3e5149453e 00427f4000 4261514946 2141454b31 1814127f10 2745454539 3c4a494930 0171090503'  # 01234567
+    '3649494936 064949291e 0036360000 0056360000 0814224100 1414141414 0041221408 0201510906'  # 89:;<=>?
+    '324979413e 7e1111117e 7f49494936 3e41414122 7f4141221c 7f49494941 7f09090901 3e4149497a'  # @ABCDEFG
+    '7f0808087f 00417f4100 2040413f01 7f08142241 7f40404040 7f020c027f 7f0408107f 3e4141413e'  # HIJKLMNO
+    '7f09090906 3e4151215e 7f09192946 4649494931 01017f0101 3f4040403f 1f2040201f 3f4038403f'  # PQRSTUVW
+    '6314081463 0708700807 6151494543 007f414100 0204081020 0041417f00 0402010204 4040404040'  # XYZ[\\]^_
+    '0001020400 2054545478 7f48444438 3844444420 384444487f 3854545418 087e090102 0c5252523e'  # `abcdefg
+    '7f08040478 00447d4000 2040443d00 7f10284400 00417f4000 7c04180478 7c08040478 3844444438'  # hijklmno
+    '7c14141408 081414187c 7c08040408 4854545420 043f444020 3c4040207c 1c2040201c 3c4030403c'  # pqrstuvw
+    '4428102844 0c5050503c 4464544c44 0008364100 00007f0000 0041360800 0201020402'  # xyz{|}~
+]
+
+# digits, upper case and common punctuation, 3 columns x 5 rows, lower case
+# is shown as upper case
+_3X5 = {
+    '0': b'\x1f\x11\x1f',
+    '1': b'\x12\x1f\x10',
+    '2': b'\x1d\x15\x17',
+    '3': b'\x15\x15\x1f',
+    '4': b'\x07\x04\x1f',
+    '5': b'\x17\x15\x1d',
+    '6': b'\x1f\x15\x1d',
+    '7': b'\x01\x01\x1f',
+    '8': b'\x1f\x15\x1f',
+    '9': b'\x17\x15\x1f',
+    'A': b'\x1e\x05\x1e',
+    'B': b'\x1f\x15\x0a',
+    'C': b'\x0e\x11\x11',
+    'D': b'\x1f\x11\x0e',
+    'E': b'\x1f\x15\x11',
+    'F': b'\x1f\x05\x01',
+    'G': b'\x0e\x11\x1d',
+    'H': b'\x1f\x04\x1f',
+    'I': b'\x11\x1f\x11',
+    'J': b'\x08\x10\x0f',
+    'K': b'\x1f\x04\x1b',
+    'L': b'\x1f\x10\x10',
+    'M': b'\x1f\x06\x1f',
+    'N': b'\x1f\x01\x1e',
+    'O': b'\x0e\x11\x0e',
+    'P': b'\x1f\x05\x02',
+    'Q': b'\x0e\x19\x16',
+    'R': b'\x1f\x05\x1a',
+    'S': b'\x12\x15\x09',
+    'T': b'\x01\x1f\x01',
+    'U': b'\x1f\x10\x1f',
+    'V': b'\x0f\x10\x0f',
+    'W': b'\x1f\x0c\x1f',
+    'X': b'\x1b\x04\x1b',
+    'Y': b'\x03\x1c\x03',
+    'Z': b'\x19\x15\x13',
+    ' ': b'\x00\x00\x00',
+    '.': b'\x00\x10\x00',
+    ',': b'\x10\x08\x00',
+    '!': b'\x00\x17\x00',
+    '?': b'\x01\x15\x02',
+    '-': b'\x04\x04\x04',
+    '+': b'\x04\x0e\x04',
+    ':': b'\x00\x0a\x00',
+    "'": b'\x00\x03\x00',
+    '/': b'\x18\x04\x03',
+    '=': b'\x0a\x0a\x0a',
+    '(': b'\x0e\x11\x00',
+    ')': b'\x00\x11\x0e',
+
+}
+
+# digits, upper case and common punctuation drawn for the full 7 rows of a
+# panel, 3 to 5 columns wide by letter, lower case is shown as upper case
+_7 = {
+    'A': b'\x7e\x09\x09\x7e',
+    'B': b'\x7f\x49\x49\x36',
+    'C': b'\x3e\x41\x41\x22',
+    'D': b'\x7f\x41\x41\x3e',
+    'E': b'\x7f\x49\x49\x41',
+    'F': b'\x7f\x09\x09\x01',
+    'G': b'\x3e\x41\x49\x7a',
+    'H': b'\x7f\x08\x08\x7f',
+    'I': b'\x41\x7f\x41',
+    'J': b'\x30\x40\x41\x3f',
+    'K': b'\x7f\x08\x14\x63',
+    'L': b'\x7f\x40\x40\x40',
+    'M': b'\x7f\x02\x0c\x02\x7f',
+    'N': b'\x7f\x06\x18\x7f',
+    'O': b'\x3e\x41\x41\x3e',
+    'P': b'\x7f\x09\x09\x06',
+    'Q': b'\x3e\x41\x21\x5e',
+    'R': b'\x7f\x09\x19\x66',
+    'S': b'\x26\x49\x49\x32',
+    'T': b'\x01\x01\x7f\x01\x01',
+    'U': b'\x3f\x40\x40\x3f',
+    'V': b'\x0f\x30\x40\x30\x0f',
+    'W': b'\x7f\x20\x18\x20\x7f',
+    'X': b'\x77\x08\x08\x77',
+    'Y': b'\x03\x04\x78\x04\x03',
+    'Z': b'\x61\x51\x4d\x43',
+    '0': b'\x3e\x49\x45\x3e',
+    '1': b'\x42\x7f\x40',
+    '2': b'\x62\x51\x49\x46',
+    '3': b'\x22\x49\x49\x36',
+    '4': b'\x1c\x12\x7f\x10',
+    '5': b'\x27\x45\x45\x39',
+    '6': b'\x3e\x49\x49\x30',
+    '7': b'\x01\x71\x09\x07',
+    '8': b'\x36\x49\x49\x36',
+    '9': b'\x06\x49\x49\x3e',
+    ' ': b'\x00\x00',
+    '.': b'\x40',
+    ',': b'\x40\x20',
+    '!': b'\x5f',
+    '?': b'\x02\x51\x09\x06',
+    '-': b'\x08\x08\x08',
+    '+': b'\x08\x1c\x08',
+    ':': b'\x24',
+    "'": b'\x03',
+    '"': b'\x03\x00\x03',
+    '/': b'\x60\x1c\x03',
+    '=': b'\x14\x14\x14',
+    '(': b'\x3e\x41',
+    ')': b'\x41\x3e',
+}
+
+FONT_5X7 = BitmapFont(_hex_glyphs(0x20, _5X7, 5), 7)
+FONT_3X5 = BitmapFont(_3X5, 5)
+# variable width font using the full 7 rows of a panel
+FONT_7 = BitmapFont(_7, 7)
+
+
+@lru_cache(maxsize=None)
+def _shift_table(shift, height):
+    """
+    Translate table moving column bytes down by shift rows (up if negative)
+    clipped to height rows
+    """
+    mask = (1 << height) - 1
+    if shift >= 0:
+        return bytes(((v << shift) & mask) for v in range(256))
+    return bytes(((v >> -shift) & mask) for v in range(256))
+
+
+def compose(display, text, font=FONT_5X7, xy=(0, 0)):
+    """
+    Compose text straight into panel column bytes for display, in the same
+    format as Display.pack(), without drawing into the display image. Send
+    with display.send(packed=compose(display, text)).
+
+    Keyword arguments:
+    display -- Display to compose for, panels must not be rotated
+    text -- text to compose
+    font -- BitmapFont
+    xy -- position of the top left of the text, may be off the display
+    """
+    w = display.im.size[0]
+    x, y = xy
+    cols = font.columns(text)
+    # one byte per display column holding the text rows, clipped to the display
+    line = bytearray(w)
+    start, end = max(0, x), min(w, x + len(cols))
+    if start < end:
+        line[start:end] = cols[start - x:end - x]
+    ret = {}
+    for address, panel in display.panels.items():
+        (xs, ys), (pw, ph), rotate, mirror = panel_orientation(panel)
+        if rotate or mirror:
+            raise ValueError('Bitmap text only supports panels without rotation')
+        shift = y - ys
+        if -font.height < shift < ph:
+            ret[address] = bytearray(line[xs:xs + pw].translate(_shift_table(shift, ph)))
+        else:
+            ret[address] = bytearray(pw)
+    return ret
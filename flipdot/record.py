@@ -0,0 +1,210 @@
+#! /usr/bin/env python
+#
+# record.py -- binary recording and memory mapped replay of display output
+#
+# File layout, all little endian:
+#   header: magic "FDOT", version (u8), flags (u8), width, height and panel
+#           count (u16 each)
+#   panel:  address (u8), x, y, w, h, rotate (u16 each), mirror (u8), one
+#           per panel
+#   frame:  time in seconds since the first frame (f64), latch (u8), entry
+#           count (u8), then entries
+#   entry:  address (u8), kind (u8), data length (u8), then either the data
+#           or, if kind has DELTA set, a change count (u8) and that many
+#           (index, value) byte pairs against the last data for the address
+#
+# Only what was written to the panels is recorded, so panels skipped as
+# unchanged don't appear in a frame.
+
+import mmap
+import struct
+import time
+
+MAGIC = b'FDOT'
+VERSION = 1
+
+# header flags
+DELTAS = 1
+
+# entry kinds
+REFRESH = 1
+DELTA = 2
+
+HEADER = struct.Struct('<4sBBHHH')
+PANEL = struct.Struct('<BHHHHHB')
+FRAME = struct.Struct('<dBB')
+ENTRY = struct.Struct('<BBB')
+
+
+class Recorder(object):
+    """
+    Writes the frames a Display transmits to a file, use through
+    Display.start_recording and Display.stop_recording or call write
+    directly.
+    """
+
+    def __init__(self, path, size, panels, delta=True, clock=None):
+        """
+        Keyword arguments:
+        path -- file to write, replaced if it exists
+        size -- (w, h) of the display
+        panels -- display panel map, as from create_display
+        delta -- store panel data as changes against the last data sent to
+        the panel where that is smaller
+        clock -- time source in seconds, time.monotonic by default
+        """
+        self.delta = delta
+        self.clock = clock or time.monotonic
+        self.start = None
+        self.last = {}
+        self.frames = 0
+        self.f = open(path, 'wb')
+        self.f.write(HEADER.pack(MAGIC, VERSION, DELTAS if delta else 0,
+                                 size[0], size[1], len(panels)))
+        # imported here as display imports this module
+        from flipdot.display import panel_orientation
+        for address, panel in sorted(panels.items()):
+            (x, y), (w, h), rotate, mirror = panel_orientation(panel)
+            self.f.write(PANEL.pack(address, x, y, w, h, rotate, mirror))
+
+    def write(self, frames, latch=False):
+        """
+        Record a batch of panel writes as one frame
+
+        Keyword arguments:
+        frames -- iterable of (address, data, refresh), as Client.send_many
+        latch -- the batch was followed by a broadcast latch
+        """
+        now = self.clock()
+        if self.start is None:
+            self.start = now
+        frames = list(frames)
+        out = [FRAME.pack(now - self.start, latch, len(frames))]
+        for address, data, refresh in frames:
+            data = bytes(data)
+            kind = REFRESH if refresh else 0
+            last = self.last.get(address)
+            self.last[address] = data
+            if self.delta and last is not None and len(last) == len(data):
+                changes = bytes(b for i, (o, n) in enumerate(zip(last, data)) if o != n
+                                for b in (i, n))
+                if len(changes) < len(data):
+                    out.append(ENTRY.pack(address, kind | DELTA, len(data)))
+                    out.append(bytes([len(changes) // 2]))
+                    out.append(changes)
+                    continue
+            out.append(ENTRY.pack(address, kind, len(data)))
+            out.append(data)
+        self.f.write(b''.join(out))
+        self.frames += 1
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Player(object):
+    """
+    Replays a recording by memory mapping the file, so frames are streamed
+    from the page cache and full panel data is handed to the client without
+    copying.
+    """
+
+    def __init__(self, path):
+        self.f = open(path, 'rb')
+        self.map = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        magic, version, self.flags, w, h, count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a flipdot recording')
+        if version != VERSION:
+            raise ValueError('Unsupported recording version {}'.format(version))
+        self.size = (w, h)
+        self.panels = {}
+        offset = HEADER.size
+        for _ in range(count):
+            address, x, y, pw, ph, rotate, mirror = PANEL.unpack_from(self.map, offset)
+            if rotate or mirror:
+                self.panels[address] = ((x, y), (pw, ph), rotate, bool(mirror))
+            else:
+                self.panels[address] = ((x, y), (pw, ph))
+            offset += PANEL.size
+        self.offset = offset
+        self.late = 0
+
+    def frames(self):
+        """
+        Yield (time, [(address, data, refresh)], latch) for every frame. Data
+        is a view into the file or, for delta entries, a buffer that is
+        updated by later frames; copy it if it needs to be kept.
+        """
+        view = self.view
+        end = len(self.map)
+        last = {}
+        offset = self.offset
+        while offset < end:
+            t, latch, count = FRAME.unpack_from(view, offset)
+            offset += FRAME.size
+            entries = []
+            for _ in range(count):
+                address, kind, length = ENTRY.unpack_from(view, offset)
+                offset += ENTRY.size
+                if kind & DELTA:
+                    data = last[address]
+                    n = view[offset]
+                    pairs = view[offset+1:offset+1+2*n]
+                    for i in range(0, 2*n, 2):
+                        data[pairs[i]] = pairs[i+1]
+                    offset += 1 + 2*n
+                else:
+                    data = view[offset:offset+length]
+                    offset += length
+                    if self.flags & DELTAS:
+                        last[address] = bytearray(data)
+                entries.append((address, data, bool(kind & REFRESH)))
+            yield t, entries, bool(latch)
+
+    def play(self, client, speed=1.0, loop=False, clock=None, sleep=None):
+        """
+        Send the recording to a client at its recorded timing
+
+        Keyword arguments:
+        client -- open Client to send to
+        speed -- playback speed, 2.0 plays twice as fast
+        loop -- start again at the end, until interrupted
+        clock -- monotonic time source in seconds, time.monotonic by default
+        sleep -- sleep function, time.sleep by default
+
+        Returns the number of frames sent
+        """
+        clock = clock or time.monotonic
+        sleep = sleep or time.sleep
+        sent = 0
+        while True:
+            start = clock()
+            for t, entries, latch in self.frames():
+                wait = start + t / speed - clock()
+                if wait > 0:
+                    sleep(wait)
+                elif wait < 0:
+                    self.late = -wait
+                client.send_many(entries, latch=latch)
+                sent += 1
+            if not loop:
+                return sent
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
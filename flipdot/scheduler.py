@@ -0,0 +1,138 @@
+#! /usr/bin/env python
+#
+# scheduler.py -- frame rate pacing for displays
+
+import math
+import time
+
+
+class FrameScheduler(object):
+    """
+    Paces sends to a Display (or MultiDisplay) at a fixed frame rate against
+    monotonic deadlines, so render and transport time don't add to the frame
+    period. Frames whose whole slot has already passed when they are ready
+    are dropped; the next frame sent carries their changes so they are
+    effectively merged.
+
+    Typical use:
+        s = FrameScheduler(d, fps=15)
+        for ...:
+            # draw into d.im
+            s.send()
+        s.finish()
+    """
+
+    def __init__(self, display, fps=15, clock=None, sleep=None):
+        """
+        Keyword arguments:
+        display -- Display or MultiDisplay to send
+        fps -- target frames per second
+        clock -- monotonic time source in seconds, the display's own clock
+        if it has one (eg. when capturing frames) else time.monotonic
+        sleep -- sleep function, the display's own sleep if it has one else
+        time.sleep
+        """
+        self.display = display
+        self.period = 1.0 / fps
+        self.clock = clock or getattr(display, 'clock', None) or time.monotonic
+        self.sleep = sleep or getattr(display, 'sleep', None) or time.sleep
+        self.reset()
+
+    def reset(self):
+        """
+        Restart the schedule and statistics
+        """
+        self.deadline = None
+        self.pending = False
+        # send arguments of the last dropped frame, replayed by finish
+        self.held = {}
+        self.frames = 0
+        self.dropped = 0
+        self.first = None
+        self.last = None
+        # running mean and sum of squares of lateness for jitter
+        self._late_mean = 0.0
+        self._late_m2 = 0.0
+
+    def tick(self, hold=None, drop=True):
+        """
+        Wait for the next frame deadline and move it on by hold. Use directly
+        for frames sent outside of the scheduler.
+
+        Keyword arguments:
+        hold -- seconds to show this frame for, one frame period by default
+        drop -- allow the frame to be dropped if its slot has already passed
+
+        Returns False if the frame should be dropped
+        """
+        hold = self.period if hold is None else hold
+        now = self.clock()
+        if self.deadline is None:
+            self.deadline = now
+        late = now - self.deadline
+        if drop and late >= hold and hold > 0:
+            self.deadline += hold
+            self.dropped += 1
+            self.pending = True
+            return False
+        if late < 0:
+            self.sleep(-late)
+            now = self.clock()
+        self._record(now - self.deadline, now)
+        self.deadline += hold
+        self.pending = False
+        return True
+
+    def send(self, hold=None, drop=True, **kwargs):
+        """
+        Send the display at its next frame deadline, or drop the frame if the
+        transport has fallen behind. Extra keyword arguments are passed on to
+        the display send.
+
+        Returns True if the frame was sent
+        """
+        if not self.tick(hold, drop):
+            self.held = kwargs
+            return False
+        self.display.send(**kwargs)
+        return True
+
+    def finish(self, **kwargs):
+        """
+        Send the last frame if it was dropped, with the arguments it was
+        sent with (eg. packed), and hold it for its slot
+        """
+        if self.pending:
+            self.dropped -= 1
+            self.send(drop=False, **dict(self.held, **kwargs))
+        if self.deadline is not None:
+            wait = self.deadline - self.clock()
+            if wait > 0:
+                self.sleep(wait)
+
+    def _record(self, late, now):
+        self.frames += 1
+        if self.first is None:
+            self.first = now
+        self.last = now
+        delta = late - self._late_mean
+        self._late_mean += delta / self.frames
+        self._late_m2 += delta * (late - self._late_mean)
+
+    @property
+    def fps(self):
+        """
+        Achieved frames per second
+        """
+        if self.frames < 2 or self.last == self.first:
+            return 0.0
+        return (self.frames - 1) / (self.last - self.first)
+
+    @property
+    def jitter(self):
+        """
+        Standard deviation in seconds of frame send times from their deadlines
+        """
+        if self.frames < 2:
+            return 0.0
+        return math.sqrt(self._late_m2 / (self.frames - 1))
@@ -0,0 +1,131 @@
+#! /usr/bin/env python
+#
+# sender.py -- background transmission for a Display
+
+import threading
+import time
+
+
+class BackgroundSender(threading.Thread):
+    """
+    Sends frames for a Display from its own thread so that rendering and
+    transmission overlap. Frames are published into a single "latest wins"
+    slot: if the previous frame has not been picked up by the time the next
+    one is published it is dropped rather than queued.
+
+    Use through Display.start_sender and Display.stop_sender
+    """
+
+    def __init__(self, display):
+        super(BackgroundSender, self).__init__()
+        self.daemon = True
+        self.display = display
+        self.cond = threading.Condition()
+        self.slot = None
+        self.stopping = False
+        self.busy = False
+        # set when the thread has finished
+        self.done = False
+        # last exception raised by a transmit, raised again from the next
+        # publish, flush or stop
+        self.error = None
+        # counters
+        self.published = 0
+        self.sent = 0
+        self.dropped = 0
+        self.skipped = 0
+        self.latency = 0.0
+        self.total_latency = 0.0
+
+    @property
+    def depth(self):
+        """
+        Frames waiting to be sent, 0 or 1
+        """
+        return 0 if self.slot is None else 1
+
+    @property
+    def mean_latency(self):
+        """
+        Mean seconds from publish to the frame being written
+        """
+        return self.total_latency / self.sent if self.sent else 0.0
+
+    def publish(self, packed, refresh=True, force=False, sync=None):
+        """
+        Hand a packed frame to the sender thread, replacing any frame still
+        waiting. Raises the error of a failed earlier transmit, if any.
+        """
+        self.raise_error()
+        with self.cond:
+            if self.slot is not None:
+                self.dropped += 1
+            self.slot = (time.perf_counter(), packed, refresh, force, sync)
+            self.published += 1
+            self.cond.notify()
+
+    def flush(self):
+        """
+        Wait until the waiting frame, if any, has been sent or the thread
+        has stopped
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: (self.slot is None and not self.busy)
+                               or self.done or not self.is_alive())
+        self.raise_error()
+
+    def stop(self):
+        """
+        Send any waiting frame then stop the thread
+        """
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+        if self.is_alive():
+            self.join()
+        self.raise_error()
+
+    def raise_error(self):
+        """
+        Raise, once, the exception of a failed transmit
+        """
+        with self.cond:
+            error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def run(self):
+        try:
+            self.loop()
+        finally:
+            with self.cond:
+                self.done = True
+                self.busy = False
+                self.cond.notify_all()
+
+    def loop(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.slot is not None or self.stopping)
+                if self.slot is None:
+                    return
+                published, packed, refresh, force, sync = self.slot
+                self.slot = None
+                self.busy = True
+            try:
+                self.display.skipped = 0
+                skipped = self.display.transmit(packed, refresh, force, sync)
+            except Exception as e:
+                # keep the thread alive (eg. a gateway rebooting refuses a few
+                # datagrams) and report the error from the caller's thread
+                skipped = None
+                with self.cond:
+                    self.error = e
+            self.latency = time.perf_counter() - published
+            with self.cond:
+                self.busy = False
+                if skipped is not None:
+                    self.sent += 1
+                    self.skipped += skipped
+                    self.total_latency += self.latency
+                self.cond.notify_all()
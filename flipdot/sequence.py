@@ -0,0 +1,283 @@
+#! /usr/bin/env python
+#
+# sequence.py -- animations compiled to packed panel frames
+
+import hashlib
+import os
+import struct
+import tempfile
+
+from flipdot.display import Display
+from flipdot.scheduler import FrameScheduler
+
+# bump when the stored frame format changes so stale disk caches are ignored
+FORMAT = 2
+
+# Disk cache file layout, all little endian, data only so a cache directory
+# can't be used to run code:
+#   header: magic "FSEQ", format (u8), frame count (u32)
+#   frame:  hold in seconds (f64), refresh (u8), panel count (u16)
+#   panel:  address (u8), data length (u8), then the data
+MAGIC = b'FSEQ'
+HEADER = struct.Struct('<4sBI')
+FRAME = struct.Struct('<dBH')
+PANEL = struct.Struct('<BB')
+
+
+class CaptureDisplay(Display):
+    """
+    Display that records what would be sent instead of sending it. It has
+    its own virtual clock and sleep, which FrameScheduler picks up, so an
+    animation runs through in no time while its frame timing is kept.
+    """
+
+    def __init__(self, w, h, panels=None, mode="RGB"):
+        super(CaptureDisplay, self).__init__(w, h, panels, mode=mode)
+        self.now = 0.0
+        # list of (time, packed, refresh)
+        self.captured = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(0.0, seconds)
+
+    def send(self, refresh=True, force=False, sync=None, packed=None):
+        if packed is None:
+            packed = self.pack()
+        self.captured.append((self.now, packed, refresh))
+        return 0
+
+    async def send_async(self, refresh=True, force=False, sync=None, packed=None):
+        return self.send(refresh, force, sync, packed)
+
+
+class Sequence(object):
+    """
+    Compiled animation: a list of (hold, packed, refresh) frames for one
+    display geometry, where packed is address -> column bytes as returned by
+    Display.pack() and hold is seconds to show the frame for.
+
+    Playing a sequence sends the stored bytes, nothing is drawn or packed
+    and the display image is left untouched.
+    """
+
+    def __init__(self, frames, geometry):
+        self.frames = frames
+        self.geometry = geometry
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def duration(self):
+        return sum(f[0] for f in self.frames)
+
+    def play(self, display, drop=True, **kwargs):
+        """
+        Send the frames to display at their timing. Extra keyword arguments
+        are passed on to the display send.
+
+        Keyword arguments:
+        display -- Display with the geometry the sequence was compiled for
+        drop -- allow frames to be dropped if the transport falls behind, the
+        last frame is always sent
+
+        Returns the FrameScheduler used, for its statistics
+        """
+        if geometry(display) != self.geometry:
+            raise ValueError('Sequence was compiled for a different display geometry')
+        s = FrameScheduler(display)
+        last = len(self.frames) - 1
+        for i, (hold, packed, refresh) in enumerate(self.frames):
+            s.send(hold=hold, drop=drop and i < last, packed=packed, refresh=refresh, **kwargs)
+        s.finish()
+        return s
+
+
+def geometry(display):
+    """
+    Hashable description of everything about a display that changes its
+    packed frames
+    """
+    return (display.im.size, display.im.mode, tuple(sorted(display.panels.items())))
+
+
+def code_hash(animation):
+    """
+    Digest of an animation's code, including functions defined within it,
+    so editing an animation invalidates its cached sequences. Callables
+    without code (eg. partials) hash to the same value whatever they do.
+    """
+    h = hashlib.sha1()
+
+    def add(code):
+        h.update(code.co_code)
+        h.update(repr(code.co_names).encode())
+        for c in code.co_consts:
+            if hasattr(c, 'co_code'):
+                add(c)
+            else:
+                h.update(repr(c).encode())
+
+    code = getattr(animation, '__code__', None)
+    if code is not None:
+        add(code)
+    return h.hexdigest()
+
+
+def dump(seq):
+    """
+    Serialise the frames of a Sequence to bytes, see the layout above
+    """
+    out = [HEADER.pack(MAGIC, FORMAT, len(seq.frames))]
+    for hold, packed, refresh in seq.frames:
+        out.append(FRAME.pack(hold, refresh, len(packed)))
+        for address, data in packed.items():
+            out.append(PANEL.pack(address, len(data)))
+            out.append(bytes(data))
+    return b''.join(out)
+
+
+def parse(b, geometry):
+    """
+    Sequence for geometry from bytes written by dump, raises ValueError if
+    they are not a whole sequence
+    """
+    magic, version, count = HEADER.unpack_from(b, 0)
+    if magic != MAGIC or version != FORMAT:
+        raise ValueError('Not a sequence of format {}'.format(FORMAT))
+    offset = HEADER.size
+    frames = []
+    for _ in range(count):
+        hold, refresh, panels = FRAME.unpack_from(b, offset)
+        offset += FRAME.size
+        packed = {}
+        for _ in range(panels):
+            address, length = PANEL.unpack_from(b, offset)
+            offset += PANEL.size
+            if offset + length > len(b):
+                raise ValueError('Truncated sequence')
+            packed[address] = bytearray(b[offset:offset + length])
+            offset += length
+        frames.append((hold, packed, bool(refresh)))
+    if offset != len(b):
+        raise ValueError('Trailing data after sequence')
+    return Sequence(frames, geometry)
+
+
+def compile_animation(display, animation, *args, **kwargs):
+    """
+    Run animation(d, *args, **kwargs) against a CaptureDisplay with the
+    geometry of display and return the frames as a Sequence. The capture
+    starts from a blank image. Consecutive identical frames are merged.
+    """
+    (w, h), mode, panels = geometry(display)
+    capture = CaptureDisplay(w, h, dict(panels), mode=mode)
+    animation(capture, *args, **kwargs)
+    frames = []
+    times = capture.captured
+    for i, (t, packed, refresh) in enumerate(times):
+        end = times[i+1][0] if i+1 < len(times) else capture.now
+        hold = end - t
+        if frames and frames[-1][1] == packed and frames[-1][2] == refresh:
+            frames[-1] = (frames[-1][0] + hold, packed, refresh)
+        else:
+            frames.append((hold, packed, refresh))
+    return Sequence(frames, geometry(display))
+
+
+class SequenceCache(object):
+    """
+    Compiles animations on first use and keeps the Sequences in memory and,
+    if a directory is given, on disk so they survive restarts. Entries are
+    keyed by the animation's qualified name, a hash of its code, its
+    arguments and the display geometry, so arguments should have a stable
+    repr (numbers, strings, tuples) for the disk cache to hit. Only the code
+    of the animation itself is hashed, clear the disk cache after changing
+    a function it calls.
+
+    The disk cache holds only frame data, never code, but keep it in a
+    directory only the display's user can write to.
+
+    Animations with random choices are compiled once with whatever choices
+    were made, pass those as arguments to vary them.
+    """
+
+    def __init__(self, directory=None):
+        """
+        Keyword arguments:
+        directory -- directory for the disk cache, memory only if None
+        """
+        self.directory = directory
+        self.sequences = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, display, animation, args, kwargs):
+        name = '{}.{}'.format(animation.__module__, animation.__qualname__)
+        ident = repr((FORMAT, name, code_hash(animation), args, sorted(kwargs.items()),
+                      geometry(display)))
+        return hashlib.sha1(ident.encode()).hexdigest()
+
+    def get(self, display, animation, *args, **kwargs):
+        """
+        Sequence of animation(d, *args, **kwargs) for the display, compiled
+        if not already cached
+        """
+        key = self.key(display, animation, args, kwargs)
+        seq = self.sequences.get(key)
+        if seq is None:
+            seq = self.load(key, geometry(display))
+        if seq is None:
+            self.misses += 1
+            seq = compile_animation(display, animation, *args, **kwargs)
+            self.save(key, seq)
+        else:
+            self.hits += 1
+        self.sequences[key] = seq
+        return seq
+
+    def play(self, display, animation, *args, **kwargs):
+        """
+        Play animation on display from its compiled Sequence
+        """
+        return self.get(display, animation, *args, **kwargs).play(display)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.fseq')
+
+    def load(self, key, geom):
+        if not self.directory:
+            return None
+        try:
+            with open(self.path(key), 'rb') as f:
+                return parse(f.read(), geom)
+        except (OSError, ValueError, struct.error):
+            # missing, truncated or from another version: compile again
+            return None
+
+    def save(self, key, seq):
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # write to a temporary file and rename so readers never see half a file
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(dump(seq))
+            os.replace(tmp, self.path(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def clear(self):
+        """
+        Forget the in memory sequences, disk files are kept
+        """
+        self.sequences.clear()
+
+
+# shared in memory cache
+cache = SequenceCache()
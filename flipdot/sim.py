@@ -1,26 +1,40 @@
 #! /usr/bin/env python
 #
 # python flipdot display simulator
+#
+# Run as a curses tui, or with --headless keeping the display in memory and
+# printing statistics. Can also be used from Python:
+#
+#   s = sim.DisplaySim(56, 14, display.create_display((28, 7), (56, 14)))
+#   server = sim.start_server(s, 'udp', 5000)
+#   ...
+#   s.stats()
+#   sim.stop_server(server)
 
 
 from __future__ import print_function
 import sys
 
+import argparse
+import asyncio
+import collections
 import curses
+import heapq
+import itertools
+import json
+import socket
+import struct
 import threading
 import time
 import serial
 
-if sys.version_info.major == 2:
-    import SocketServer as socketserver
-else:
-    import socketserver
+from PIL import Image
 
-from PIL import Image, ImageOps
-
-import display
-
-import argparse
+try:
+    from flipdot import client, display
+except ImportError:
+    import client
+    import display
 
 parser = argparse.ArgumentParser(description='Run a tui Alfa-Zeta flot-dot simulation')
 parser.add_argument('-P','--protocol', type=str, choices=['tcp', 'udp', 'usb'],
@@ -38,92 +52,249 @@ parser.add_argument('-y','--height', type=int, default=14,
                     help='display height, should be multiple of panel height 7')
 parser.add_argument('--portrait', action='store_true',
                     help='panels are in portrait orientation so rotate tui for display')
+parser.add_argument('-l','--layout', type=str, default=None,
+                    help='JSON layout of gateways for a whole installation, see from_layout')
+parser.add_argument('--timing', action='store_true',
+                    help='model bus rate, flip time and latching of real panels')
+parser.add_argument('--baud', type=int, default=57600,
+                    help='RS485 bus rate for --timing')
+parser.add_argument('--flip', type=float, default=100.0 / 28,
+                    help='milliseconds to flip a column of dots for --timing')
+parser.add_argument('--buffer', type=int, default=None,
+                    help='gateway buffer in bytes for --timing, frames beyond it are dropped')
+parser.add_argument('--headless', action='store_true',
+                    help='no tui, print statistics every interval instead')
+parser.add_argument('-i','--interval', type=float, default=1.0,
+                    help='seconds between headless statistics reports')
 parser.add_argument('-v','--verbose', action='store_true',
                     help='enabling verbose debugging output')
-args = parser.parse_args()
 
-RefreshRate = args.refresh
-sim = None
-stdscr = None
-debugPos = (args.width+3, 1) if args.portrait else (args.height+3, 1)
+# translate tables taking a column byte to the dot (0 or 1) of each row
+_ROW_DOTS = [bytes((b >> y) & 1 for b in range(256)) for y in range(8)]
+
+# cell characters for the dot pair (top + 2 * bottom) after translate
+_HALF = {0: " ", 1: "▀", 2: "▄", 3: "█"}
+
+# data length for each command
+FRAME_LENGTH = {
+    0x81: 112, 0x82: 112,
+    0x83: 28, 0x84: 28,
+    0x85: 56, 0x86: 56,
+    # send time, a double
+    client.TIMESTAMP: 8,
+}
+
+LATCH = b"\x80\x82\xff\x8f"
+
+
+def problem(data):
+    """
+    Reason a frame is malformed, None if it is good
+    """
+    if len(data) < 4:
+        return "too short"
+    if data[0] != 0x80:
+        return "no start"
+    if data[1] not in FRAME_LENGTH:
+        return "not right command"
+    # broadcast latch of data sent with no refresh
+    if data == LATCH:
+        return None
+    if len(data) != FRAME_LENGTH[data[1]] + 4:
+        return "bad length"
+    if data[-1] != 0x8F:
+        return "no end"
+    return None
+
+
+class FrameParser(object):
+    """
+    Incremental parser for a byte stream of frames, as from TCP or serial.
+    Feed it chunks of any size and it returns the complete frames found,
+    keeping any partial frame for the next chunk. Bytes that can't start a
+    frame, or a start whose frame doesn't end where its command says, are
+    skipped so the parser resyncs on the next start byte. Panel data is
+    7 bit so a 0x80 within a frame can only be in a timestamp.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+        # bytes discarded while resyncing
+        self.skipped = 0
+
+    def feed(self, data):
+        """
+        Add a chunk of the stream, returns list of complete frames
+        """
+        buf = self.buf
+        buf += data
+        frames = []
+        n = len(buf)
+        i = 0
+        while i < n:
+            start = buf.find(0x80, i)
+            if start < 0:
+                self.skipped += n - i
+                i = n
+                break
+            self.skipped += start - i
+            i = start
+            if start + 4 > n:
+                break
+            if buf[start:start + 4] == LATCH:
+                frames.append(bytes(buf[start:start + 4]))
+                i = start + 4
+                continue
+            length = FRAME_LENGTH.get(buf[start + 1])
+            if length is None:
+                self.skipped += 1
+                i = start + 1
+                continue
+            end = start + length + 4
+            if end > n:
+                break
+            if buf[end - 1] != 0x8F:
+                self.skipped += 1
+                i = start + 1
+                continue
+            frames.append(bytes(buf[start:end]))
+            i = end
+        del buf[:i]
+        return frames
+
+
+def split(raw):
+    """
+    Split a buffer of back to back frames (as packed by a batched client
+    write) into single frames using the length implied by each command
+    """
+    i = 0
+    while i < len(raw):
+        ln = FRAME_LENGTH.get(raw[i + 1], 0) if i + 1 < len(raw) else 0
+        # broadcast latch carries no data
+        if raw[i + 1:i + 4] == LATCH[1:]:
+            ln = 0
+        yield raw[i:i + ln + 4]
+        i += ln + 4
+
+
+class UDPProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, sim, gateway=None):
+        self.sim = sim
+        self.gateway = gateway
+
+    def datagram_received(self, data, addr):
+        self.sim.apply(data, gateway=self.gateway)
+
+
+class TCPProtocol(asyncio.Protocol):
+    """
+    One per connection, like the Ethernet -> RS485 boxes the connection
+    stays open until the client closes it
+    """
+
+    def __init__(self, sim, gateway=None):
+        self.sim = sim
+        self.gateway = gateway
+        self.parser = FrameParser()
+
+    def data_received(self, data):
+        self.sim.apply(data, self.parser, self.gateway)
+
+
+class Server(threading.Thread):
+    """
+    Listeners for every endpoint of a sim on an asyncio event loop in one
+    background thread. Every datagram and stream chunk is applied to the
+    sim from that thread in arrival order, so frames are never reordered or
+    contend with each other; rendering runs separately on its own tick.
+    Serial endpoints are read by a thread each, which hands every chunk
+    read to the loop to apply.
+    """
+
+    def __init__(self, sim, endpoints):
+        """
+        Keyword arguments:
+        sim -- DisplaySim to apply frames to
+        endpoints -- list of (protocol, host, port, gateway) where protocol
+        is 'udp', 'tcp' or 'usb' (port being the serial device) and gateway
+        the sim gateway frames are for, None for a single display sim
+        """
+        super(Server, self).__init__()
+        self.daemon = True
+        for protocol, _, _, _ in endpoints:
+            if protocol not in ('udp', 'tcp', 'usb'):
+                raise ValueError('Invalid protocol')
+        self.sim = sim
+        self.endpoints = endpoints
+        self.loop = asyncio.new_event_loop()
+        self.serials = [SerialHandler(port, sim, gateway, self.loop)
+                        for protocol, _, port, gateway in endpoints if protocol == 'usb']
+        self.ready = threading.Event()
+        self.error = None
+        self.closers = []
+
+    async def listen(self):
+        for protocol, host, port, gateway in self.endpoints:
+            if protocol == 'udp':
+                transport, _ = await self.loop.create_datagram_endpoint(
+                    lambda g=gateway: UDPProtocol(self.sim, g), local_addr=(host, port))
+                # room for bursts while a frame is being applied
+                sock = transport.get_extra_info('socket')
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+                self.closers.append(transport.close)
+            elif protocol == 'tcp':
+                server = await self.loop.create_server(
+                    lambda g=gateway: TCPProtocol(self.sim, g), host, port)
+                self.closers.append(server.close)
 
-class Handler(socketserver.BaseRequestHandler):
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.listen())
+        except Exception as e:
+            self.error = e
+        self.ready.set()
+        if self.error is None:
+            self.loop.run_forever()
+        for close in self.closers:
+            close()
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
 
-    def handle(self):
-        pass
+    def open(self):
+        self.start()
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
+        for handler in self.serials:
+            handler.open()
+
+    def close(self):
+        for handler in self.serials:
+            handler.close()
+        if self.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.join()
 
-    @staticmethod
-    def validate(raw):
-        if sys.version_info.major == 2:
-            data = [ord(x) for x in raw]
-        else:
-            data = raw
-        if data[0] != 0x80:
-            print("no start")
-            return []
-        if data[1] not in (0x81, 0x82, 0x83, 0x84, 0x85, 0x86):
-            print("not right command")
-            return []
-        ln = 0
-        if data[1] in (0x81, 0x82):
-            ln = 112
-        elif data[1] in (0x83, 0x84):
-            ln = 28
-        elif data[1] in (0x85, 0x86):
-            ln = 56
-        if len(data) != (ln + 4):
-            print("bad length", len(data))
-            return []
-        if data[-1] != 0x8F:
-            print("no end")
-            return []
-        return data
-
-    @staticmethod
-    def update_display(data):
-        address = data[2]
-        body = data[3:-1]
-        if args.verbose:
-            debug = "ADR: {} DATA: {}".format(address, ' '.join('{:02X}'.format(x) for x in data))
-            stdscr.addstr(debugPos[0]+address, debugPos[1], debug, curses.color_pair(3))
-        sim.update(address, body)
-
-class TCPHandler(Handler):
-
-    def handle(self):
-        """
-        handle will close socket on return so stay here waiting for recv (will
-        return 0 on break) this behavior is like the Ethernet -> RS485 boxes.
-        Socket is blocking but this is a thread so it's ok
-        """
-        while 1:
-            data = bytearray()
-            chunk = None
-            # unload until we get the end of frame char (or client disconnect)
-            while chunk != b"\x8F":
-                chunk = self.request.recv(1)
-                # client closed so return and close server connection
-                if chunk == b"":
-                    return
-                data.extend(chunk)
-            if len(data) > 0:
-                data = self.validate(data)
-                self.update_display(data)
-
-class UDPHandler(Handler):
-
-    def handle(self):
-        data = self.request[0]
-        data = self.validate(data)
-        if data:
-            self.update_display(data)
 
 class SerialHandler():
-    def __init__(self, port):
+    """
+    Reads a serial port on its own thread. Chunks read are applied to sim on
+    loop if given, so they are in order with the other endpoints of a
+    Server, otherwise from the reader thread.
+    """
+
+    def __init__(self, port, sim, gateway=None, loop=None):
+        self.sim = sim
+        self.gateway = gateway
+        self.loop = loop
         self.chan = serial.Serial()
         self.chan.baudrate = 57600
         self.chan.port = port
-        self.chan.timeout = 10.0
+        self.chan.timeout = 1.0
+        self.parser = FrameParser()
         self.thread = threading.Thread(target=self.read_from_port)
         self.thread.daemon = True
 
@@ -135,49 +306,491 @@ class SerialHandler():
         self.chan.close()
 
     def read_from_port(self):
-        while True:
-            if self.chan.in_waiting > 0:
-                data = self.chan.read_until(b"\x8F")
-                if data: self.handle(data)
-
-    def handle(self, data):
-        data = Handler.validate(data)
-        if data:
-            Handler.update_display(data)
-
-class ThreadedUDPServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
-    pass
+        while self.chan.is_open:
+            # block for at least a byte, then take whatever else is waiting
+            try:
+                data = self.chan.read(max(1, self.chan.in_waiting))
+            except (serial.SerialException, TypeError, OSError):
+                return
+            if not data:
+                continue
+            if self.loop is None:
+                self.sim.apply(data, self.parser, self.gateway)
+                continue
+            try:
+                self.loop.call_soon_threadsafe(self.sim.apply, data, self.parser, self.gateway)
+            except RuntimeError:
+                # loop closed, the server is shutting down
+                return
+
+
+def start_server(sim, protocol='udp', port=5000, usb='/dev/ttyUSB0', host='localhost', endpoints=None):
+    """
+    Start listening for frames for sim in the background, on the given
+    protocol and port or on a list of endpoints as for Server. Returns the
+    server to pass to stop_server
+    """
+    if endpoints is None:
+        endpoints = [(protocol, host, usb if protocol == 'usb' else port, None)]
+    server = Server(sim, endpoints)
+    server.open()
+    return server
+
+
+def stop_server(server):
+    server.close()
+
+
+def parse_endpoint(endpoint):
+    """
+    (protocol, host, port) of "udp:5000", "tcp:0.0.0.0:5001" or
+    "usb:/dev/ttyUSB0"
+    """
+    protocol, _, rest = endpoint.partition(':')
+    if protocol == 'usb':
+        return protocol, None, rest
+    host, _, port = rest.rpartition(':')
+    return protocol, host or 'localhost', int(port)
+
+
+def from_layout(layout, timing=None):
+    """
+    Build a DisplaySim for a whole installation of gateways, each driving
+    its own panels as one Display of a MultiDisplay. layout is a dict, or
+    the path of a JSON file, of:
+
+    {"width": w, "height": h, "gateways": {ID: {
+        "endpoint": "udp:5000",
+        "origin": [x, y],
+        "size": [w, h],
+        "rotate": 0,
+        "mirror": false,
+        "panels": {address: [[x, y], [w, h], rotate, mirror]}
+    }}}
+
+    origin, rotate and mirror place the gateway's display within the wall
+    as for MultiDisplay entries. panels is the gateway's panel map, by
+    default 28x7 panels from create_display covering size.
+
+    timing is an optional TimingModel for the sim. Returns (sim, endpoints)
+    for start_server
+    """
+    if not isinstance(layout, dict):
+        with open(layout) as f:
+            layout = json.load(f)
+    sim = DisplaySim(layout['width'], layout['height'], gateways={}, timing=timing)
+    endpoints = []
+    for gateway, g in layout['gateways'].items():
+        size = tuple(g['size'])
+        if 'panels' in g:
+            panels = {int(a): tuple(tuple(v) if isinstance(v, list) else v for v in p)
+                      for a, p in g['panels'].items()}
+        else:
+            panels = display.create_display((28, 7), size)
+        sim.add_gateway(gateway, panels, size, tuple(g.get('origin', (0, 0))),
+                        g.get('rotate', 0), g.get('mirror', False))
+        endpoints.append(parse_endpoint(g['endpoint']) + (gateway,))
+    return sim, endpoints
+
+
+def _row_slice(indices):
+    """
+    Slice of the framebuffer covering a row of dot indices, which are evenly
+    spaced for any panel orientation
+    """
+    step = indices[1] - indices[0] if len(indices) > 1 else 1
+    if any(b - a != step for a, b in zip(indices, indices[1:])):
+        raise ValueError('Panel row is not evenly spaced')
+    stop = indices[-1] + step
+    return slice(indices[0], stop if stop >= 0 else None, step)
+
+
+# commands showing their data straight away, the others hold it for a latch
+REFRESH_COMMANDS = (0x82, 0x83, 0x85)
+
+
+class TimingModel(object):
+    """
+    Hardware timing for a DisplaySim. Frames are queued on each gateway's
+    RS485 bus and only take effect once their last byte would have been
+    clocked out at the baud rate. Panels show data from refresh commands
+    (0x82, 0x83, 0x85) when it arrives, while data from no refresh commands
+    (0x81, 0x84, 0x86) is held until a refresh or broadcast latch (address
+    0xFF). Frames to address 0xFF go to every panel of the gateway.
+
+    A refresh starts the panel flipping for flip seconds per changed column,
+    the panel speed setting and the controller set that; a frame arriving at
+    a panel still flipping is counted as mid flip. Frames that would
+    overflow the gateway buffer are dropped and held data replaced before
+    it was latched is counted as superseded.
+    """
+
+    def __init__(self, baudrate=57600, flip=0.1 / 28, buffer=None, clock=None):
+        """
+        Keyword arguments:
+        baudrate -- RS485 bus rate of every gateway
+        flip -- seconds to flip one column of dots, about 100 ms a panel at
+        the fast speed setting
+        buffer -- bytes a gateway can hold waiting for the bus, unlimited if
+        None
+        clock -- monotonic time source in seconds, time.monotonic by default
+        """
+        self.byte_time = client.BITS_PER_BYTE / baudrate
+        self.flip = flip
+        self.buffer = buffer
+        self.clock = clock or time.monotonic
+        self.reset()
+
+    def reset(self):
+        # heap of (due, order, gateway, frame)
+        self.queue = []
+        self.order = itertools.count()
+        # gateway -> time its bus is free
+        self.bus = {}
+        # (gateway, address) -> data held for a latch, data shown and the
+        # time its flip ends
+        self.pending = {}
+        self.shown = {}
+        self.flipping = {}
+        self.dropped = 0
+        self.superseded = 0
+        self.mid_flip = 0
+
+    def backlog(self, now=None):
+        """
+        Seconds until the busiest bus is clear
+        """
+        now = self.clock() if now is None else now
+        return max([t - now for t in self.bus.values()] + [0.0])
 
-class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    pass
+    def push(self, gateway, data, now=None):
+        """
+        Queue a frame on the gateway's bus, returns False if it was dropped
+        """
+        now = self.clock() if now is None else now
+        free = max(self.bus.get(gateway, now), now)
+        waiting = (free - now) / self.byte_time
+        if self.buffer is not None and waiting + len(data) > self.buffer:
+            self.dropped += 1
+            return False
+        due = free + len(data) * self.byte_time
+        self.bus[gateway] = due
+        heapq.heappush(self.queue, (due, next(self.order), gateway, data))
+        return True
+
+    def advance(self, sim, now=None):
+        """
+        Apply every queued frame due by now to sim
+        """
+        now = self.clock() if now is None else now
+        while self.queue and self.queue[0][0] <= now:
+            due, _, gateway, data = heapq.heappop(self.queue)
+            self.execute(sim, gateway, data, due)
+
+    def execute(self, sim, gateway, data, t):
+        panels = sim.gateways.get(gateway, {})
+        if data == LATCH:
+            for key in [k for k in self.pending if k[0] == gateway]:
+                self.show(sim, key, self.pending.pop(key), t)
+            return
+        address = data[2]
+        body = data[3:-1]
+        addresses = list(panels) if address == client.BROADCAST else [address]
+        for a in addresses:
+            key = (gateway, a)
+            if data[1] in REFRESH_COMMANDS:
+                self.pending.pop(key, None)
+                self.show(sim, key, body, t)
+            else:
+                if key in self.pending:
+                    self.superseded += 1
+                self.pending[key] = body
+
+    def show(self, sim, key, body, t):
+        if self.flipping.get(key, 0.0) > t:
+            self.mid_flip += 1
+        last = self.shown.get(key)
+        if last is None or len(last) != len(body):
+            changed = len(body)
+        else:
+            changed = sum(1 for a, b in zip(last, body) if a != b)
+        self.shown[key] = body
+        self.flipping[key] = t + changed * self.flip
+        sim.update(key[1], body, key[0])
 
+    def stats(self, now=None):
+        """
+        Frames dropped, superseded and mid flip, frames still queued and
+        seconds of bytes waiting on the busiest bus
+        """
+        return {
+            'dropped': self.dropped,
+            'superseded': self.superseded,
+            'mid_flip': self.mid_flip,
+            'queued': len(self.queue),
+            'backlog': self.backlog(now),
+        }
+
+
+class DisplaySim(object):
+    """
+    Simulated display: the dots of every panel in a framebuffer and
+    statistics of what was received. Raw bytes from any transport go to
+    apply(), all methods are thread safe.
+
+    A sim is either a single display, with panels as for Display, or a
+    whole installation of gateways (see from_layout and add_gateway) each
+    with its own panel addresses. Panel statistics are keyed by address, or
+    (gateway, address) for gateways.
+    """
+
+    def __init__(self, w, h, panels=None, gateways=None, timing=None):
+        """
+        Keyword arguments:
+        panels -- panel map of a single display, as for Display
+        gateways -- if given, no single display; a dict of gateway ID ->
+        (panels, size, origin, rotate, mirror) as for add_gateway
+        timing -- TimingModel to apply frames with, otherwise frames take
+        effect as soon as they are received
+        """
+        self.size = (w, h)
+        self.timing = timing
+        # framebuffer of one byte per dot, 1 if lit, row major
+        self.fb = bytearray(w * h)
+        # gateway -> address -> (w, slice of the framebuffer for each row)
+        self.gateways = {}
+        if gateways is None:
+            self.panels = panels or {1: ((0, 0), (w, h))}
+            self.add_gateway(None, self.panels, self.size)
+        else:
+            self.panels = {}
+            for gateway, args in gateways.items():
+                self.add_gateway(gateway, *args)
+        # set when the framebuffer changes, cleared by rows()
+        self.dirty = True
+        # panel -> last frame received, for debug
+        self.last = {}
+        self.l = threading.RLock()
+        self.reset_stats()
 
-def start_server():
-    if args.protocol != 'usb':
-        if args.protocol == 'tcp':
-            server = ThreadedTCPServer(("localhost", args.port), TCPHandler)
-        elif args.protocol == 'udp':
-            server = ThreadedUDPServer(("localhost", args.port), UDPHandler)
+    def add_gateway(self, gateway, panels, size=None, origin=(0, 0), rotate=0, mirror=False):
+        """
+        Add a gateway driving panels, placed in the framebuffer like a
+        Display of the given size in a MultiDisplay
+
+        Keyword arguments:
+        gateway -- ID passed to apply for frames from this gateway
+        panels -- the gateway's panel map, as for Display
+        size -- (w, h) of the gateway's display, needed if rotated or mirrored
+        origin -- (x, y) of the display within the framebuffer
+        rotate -- rotation of the display, see display.orient
+        mirror -- display is mirrored
+        """
+        W, H = self.size
+        maps = {}
+        for address, panel in panels.items():
+            rows = display.panel_rows(panel, W, size, origin, rotate, mirror)
+            if min(min(r) for r in rows) < 0 or max(max(r) for r in rows) >= W * H:
+                raise ValueError('Panel {} of gateway {} is outside the display'.format(address, gateway))
+            maps[address] = (len(rows[0]), [_row_slice(r) for r in rows])
+        self.gateways[gateway] = maps
+
+    def reset_stats(self):
+        with self.l:
+            if self.timing:
+                self.timing.reset()
+            self.frames = 0
+            self.bytes = 0
+            self.latches = 0
+            self.malformed = 0
+            # stream bytes discarded resyncing
+            self.skipped = 0
+            self.errors = collections.Counter()
+            self.panel_frames = collections.Counter()
+            self.first = None
+            self.latest = None
+            self.latency = 0.0
+            self.latency_max = 0.0
+            self.latency_total = 0.0
+            self.timestamps = 0
+
+    def apply(self, raw, parser=None, gateway=None):
+        """
+        Apply a buffer of one or more back to back frames, or with parser
+        (a FrameParser), the next chunk of a stream, received by gateway
+        """
+        now = time.time()
+        with self.l:
+            if self.first is None:
+                self.first = now
+            self.latest = now
+            self.bytes += len(raw)
+            if parser is None:
+                frames = split(bytes(raw))
+            else:
+                skipped = parser.skipped
+                frames = parser.feed(raw)
+                self.skipped += parser.skipped - skipped
+            for data in frames:
+                self.frame(data, now, gateway)
+            self.advance()
+
+    def advance(self):
+        """
+        Apply frames the timing model has queued that are now due
+        """
+        if self.timing:
+            with self.l:
+                self.timing.advance(self)
+
+    def frame(self, data, now, gateway=None):
+        reason = problem(data)
+        if reason:
+            self.malformed += 1
+            self.errors[reason] += 1
+        elif data[1] == client.TIMESTAMP:
+            latency = now - struct.unpack_from('<d', data, 3)[0]
+            self.latency = latency
+            self.latency_max = max(self.latency_max, latency)
+            self.latency_total += latency
+            self.timestamps += 1
+        elif data == LATCH:
+            self.latches += 1
+            if self.timing:
+                self.timing.push(gateway, data)
         else:
-            raise ValueError('Invalid protocol')
-        server_thread = threading.Thread(target=server.serve_forever)
-        server_thread.daemon = True
-        server_thread.start()
-    else:
-        server = SerialHandler(args.usb)
-        server.open()
+            address = data[2]
+            if self.timing:
+                self.timing.push(gateway, data)
+            else:
+                self.update(address, data[3:-1], gateway)
+            key = address if gateway is None else (gateway, address)
+            self.last[key] = data
+            self.frames += 1
+            self.panel_frames[key] += 1
 
+    def stats(self):
+        """
+        Dictionary of statistics since the first frame (or reset_stats).
+        Rates are over the time from the first to the latest frame, latency
+        is only measured for clients sending timestamps. With a timing model
+        its counters (see TimingModel.stats) are included.
+        """
+        self.advance()
+        with self.l:
+            span = (self.latest - self.first) if self.first is not None else 0.0
+            timing = self.timing.stats() if self.timing else {}
+            return dict(timing, **{
+                'frames': self.frames,
+                'bytes': self.bytes,
+                'latches': self.latches,
+                'malformed': self.malformed,
+                'skipped': self.skipped,
+                'errors': dict(self.errors),
+                'panels': dict(self.panel_frames),
+                'seconds': span,
+                'fps': self.frames / span if span else 0.0,
+                'bytes_per_sec': self.bytes / span if span else 0.0,
+                'latency': self.latency,
+                'latency_mean': self.latency_total / self.timestamps if self.timestamps else 0.0,
+                'latency_max': self.latency_max,
+            })
+
+    def refresh(self, address=None, gateway=None):
+        with self.l:
+            self.dirty = True
+            if address is None:
+                self.fb[:] = bytes(len(self.fb))
+                return
+            w, slices = self.gateways[gateway][address]
+            for s in slices:
+                self.fb[s] = bytes(w)
+
+    def update(self, address, data, gateway=None):
+        # decode the column bytes into the framebuffer a panel row at a time
+        panel = self.gateways.get(gateway, {}).get(address)
+        if panel is None:
+            return
+        w, slices = panel
+        cols = bytes(data[:w])
+        if not cols:
+            return
+        if len(cols) < w:
+            # only the columns sent
+            slices = [_row_slice(range(s.start, s.stop if s.stop is not None else -1, s.step)[:len(cols)])
+                      for s in slices]
+        rows = [cols.translate(_ROW_DOTS[y]) for y in range(min(len(slices), 8))]
+        with self.l:
+            for s, row in zip(slices, rows):
+                self.fb[s] = row
+            self.dirty = True
 
+    def rows(self, portrait=False):
+        """
+        Rows of dots as seen, rotated clockwise in portrait
+        """
+        W, H = self.size
+        self.advance()
+        with self.l:
+            self.dirty = False
+            fb = bytes(self.fb)
+        if portrait:
+            # view row y is framebuffer column y read from the bottom up
+            return [fb[x::W][::-1] for x in range(W)]
+        return [fb[y*W:(y+1)*W] for y in range(H)]
+
+    def image(self):
+        """
+        Snapshot of the framebuffer as an "L" image, lit dots 255
+        """
+        self.advance()
+        with self.l:
+            return Image.frombytes("L", self.size, bytes(self.fb)).point(lambda v: v * 255)
 
-class DisplaySim(threading.Thread):
 
-    def __init__(self, w, h, panels=None, portrait=False):
-        super(DisplaySim, self).__init__()
-        self.d = display.Display(w, h, panels)
-        self.l = threading.RLock()
+class TerminalView(threading.Thread):
+    """
+    Draws a DisplaySim with curses every refresh seconds, if it changed
+    """
+
+    def __init__(self, sim, refresh=0.06, portrait=False, verbose=False, info=""):
+        super(TerminalView, self).__init__()
+        self.daemon = True
+        self.sim = sim
+        self.refresh = refresh
+        self.portrait = portrait
+        self.verbose = verbose
+        self.info = info
         self.frames = 0
+        # cell rows as last drawn
+        self.shown = []
         self.stopper = threading.Event()
-        self.portrait = portrait
+        self.stdscr = None
+        w, h = sim.size[::-1] if portrait else sim.size
+        self.debug = ((h+1)//2+3, 1)
+
+    def open(self):
+        self.stdscr = curses.initscr()
+        curses.start_color()
+        # dots
+        curses.init_pair(1, curses.COLOR_WHITE, curses.COLOR_BLACK)
+        # frame
+        curses.init_pair(2, curses.COLOR_BLACK, curses.COLOR_WHITE)
+        curses.init_pair(3, curses.COLOR_GREEN, curses.COLOR_BLACK)
+        curses.curs_set(0)
+        curses.noecho()
+
+        if self.verbose:
+            self.put(*self.debug, self.info, curses.color_pair(2))
+            self.put(self.debug[0]+1, self.debug[1], "Waiting for first data packet...", curses.color_pair(3))
+        else:
+            # make sure term is right size
+            w, h = self.sim.size[::-1] if self.portrait else self.sim.size
+            curses.resize_term((h+1)//2+4, w+4)
+
+    def close(self):
+        curses.echo()
+        curses.endwin()
 
     def stop(self):
         self.stopper.set()
@@ -185,98 +798,130 @@ class DisplaySim(threading.Thread):
 
     def run(self):
         while not self.stopper.is_set():
-            self.frames += 1
-            with self.l:
+            # nothing to draw if no frame took effect since the last tick
+            self.sim.advance()
+            if self.sim.dirty:
+                self.frames += 1
                 self.draw()
-            time.sleep(RefreshRate)
+            time.sleep(self.refresh)
+
+    def cells(self):
+        """
+        Terminal rows for the view, each cell showing a pair of dot rows
+        """
+        rows = self.sim.rows(self.portrait)
+        if len(rows) % 2:
+            rows.append(bytes(len(rows[0])))
+        out = []
+        for top, bottom in zip(rows[0::2], rows[1::2]):
+            pair = (int.from_bytes(top, 'big') | int.from_bytes(bottom, 'big') << 1)
+            out.append(pair.to_bytes(len(top), 'big').decode('latin-1').translate(_HALF))
+        return out
+
+    def put(self, y, x, text, attr):
+        """
+        addstr clipped to the terminal, so a wall bigger than the terminal
+        shows its top left
+        """
+        h, w = self.stdscr.getmaxyx()
+        if y >= h or x >= w:
+            return
+        # the bottom right cell can't be written without scrolling
+        text = text[:w - x - (1 if y == h - 1 else 0)]
+        if text:
+            self.stdscr.addstr(y, x, text, attr)
 
     def draw(self):
-        if self.portrait:
-            px = self.d.im.rotate(angle=-90, expand=1).load()
-            h, w = self.d.im.size
-        else:
-            px = self.d.im.load()
-            w, h = self.d.im.size
-        # length of - to print for horizontal frame
-        r = w*2+2
-        onoff = {True: "●", False: "○"}
-        stdscr.addstr(0, 1, "-"*r, curses.color_pair(2))
-        stdscr.addstr(h+1, 1, "-"*r, curses.color_pair(2))
-        for y in range(h):
-            stdscr.addstr(y+1, 0, "|", curses.color_pair(2))
-            stdscr.addstr(y+1, r+1, "|", curses.color_pair(2))
-            for x in range(w):
-                v = self.d.px_to_bit(px[x, y])
-                stdscr.addstr(y+1, 2+x*2, onoff[v], curses.color_pair(1))
-        stdscr.refresh()
-
-    def refresh(self, address=None):
-        with self.l:
-            self.d.reset(address)
-
-    def update(self, address, data):
-        # update the internal image from the given list of bytes
-        if address in self.d.panels.keys():
-            (xs, ys), (w, h) = self.d.panels[address]
-            n = Image.new("RGB", (w, h))
-            if h != 7:
-                print("H is not 7!!!")
-            for x in range(w):
-                # get the next byte
-                b = data[x]
-                for y in range(h):  # note that h should always be 7
-                    px = b & 0x01
-                    b = b >> 1
-                    if px:
-                        n.putpixel((x, y), (255, 255, 255))
-            with self.l:
-                self.d.im.paste(n, box=(xs, ys))
-
-
-
-def init_curses():
-    global stdscr
-    stdscr = curses.initscr()
-    curses.start_color()
-    # dots
-    curses.init_pair(1, curses.COLOR_WHITE, curses.COLOR_BLACK)
-    # frame
-    curses.init_pair(2, curses.COLOR_BLACK, curses.COLOR_WHITE)
-    curses.init_pair(3, curses.COLOR_GREEN, curses.COLOR_BLACK)
-    curses.curs_set(0)
-    curses.noecho()
-
-    if args.verbose: 
-        stdscr.addstr(*debugPos, 
-            "W: {} H: {} Portrait: {} Panels: {} Panel size: {} Port: {}".format(args.width, args.height, args.portrait,
-            len(sim.d.panels), sim.d.panels[1][1], args.port),
-            curses.color_pair(2))
-        stdscr.addstr(debugPos[0]+1, debugPos[1], "Waiting for first data packet...", curses.color_pair(3))
+        """
+        Update the cells that changed since the last draw
+        """
+        cells = self.cells()
+        if len(cells) != len(self.shown):
+            # first draw, frame and all cells
+            w = len(cells[0])
+            self.put(0, 0, "+" + "-"*w + "+", curses.color_pair(2))
+            self.put(len(cells)+1, 0, "+" + "-"*w + "+", curses.color_pair(2))
+            for y in range(len(cells)):
+                self.put(y+1, 0, "|", curses.color_pair(2))
+                self.put(y+1, w+1, "|", curses.color_pair(2))
+            self.shown = [None] * len(cells)
+        for y, (row, last) in enumerate(zip(cells, self.shown)):
+            if row == last:
+                continue
+            if last is None:
+                start, end = 0, len(row)
+            else:
+                # redraw the span between the first and last changed cell
+                start = next(i for i, (a, b) in enumerate(zip(row, last)) if a != b)
+                end = len(row) - next(i for i, (a, b) in enumerate(zip(row[::-1], last[::-1])) if a != b)
+            self.put(y+1, 1+start, row[start:end], curses.color_pair(1))
+            self.shown[y] = row
+        if self.verbose:
+            with self.sim.l:
+                last = dict(self.sim.last)
+            for i, (panel, data) in enumerate(sorted(last.items(), key=str)):
+                debug = "ADR: {} DATA: {}".format(panel, ' '.join('{:02X}'.format(x) for x in data))
+                self.put(self.debug[0]+1+i, self.debug[1], debug, curses.color_pair(3))
+        self.stdscr.refresh()
+
+
+def report(sim, interval=1.0):
+    """
+    Print the rates over each interval until interrupted
+    """
+    last = sim.stats()
+    while True:
+        time.sleep(interval)
+        now = sim.stats()
+        print("frames/s: {:.1f} bytes/s: {:.0f} malformed: {} skipped: {} latches: {} latency: {:.2f} ms (max {:.2f} ms) panels: {}".format(
+            (now['frames'] - last['frames']) / interval,
+            (now['bytes'] - last['bytes']) / interval,
+            now['malformed'], now['skipped'], now['latches'],
+            now['latency'] * 1000, now['latency_max'] * 1000,
+            ' '.join('{}:{}'.format(k, v) for k, v in sorted(now['panels'].items(), key=str))))
+        if sim.timing:
+            print("  dropped: {} superseded: {} mid flip: {} queued: {} backlog: {:.1f} ms".format(
+                now['dropped'], now['superseded'], now['mid_flip'], now['queued'], now['backlog'] * 1000))
+        sys.stdout.flush()
+        last = now
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    timing = TimingModel(args.baud, args.flip / 1000, args.buffer) if args.timing else None
+    if args.layout:
+        sim, endpoints = from_layout(args.layout, timing)
+        where = ' '.join('{}:{}'.format(e[3], e[2]) for e in endpoints)
     else:
-        # make sure term is right size
-        if args.portrait:
-            curses.resize_term(args.width*2+4, args.height*2+4)
-        else:
-            curses.resize_term(args.height*2+4, args.width*2+4)
-
-
-
-def stop_curses():
-    curses.echo()
-    curses.endwin()
-
-
-if __name__ == "__main__":
-    sim = DisplaySim(args.width, args.height, display.create_display((28, 7), (args.width, args.height)), portrait=args.portrait)
+        sim = DisplaySim(args.width, args.height, display.create_display((28, 7), (args.width, args.height)),
+                         timing=timing)
+        endpoints = [(args.protocol, 'localhost', args.usb if args.protocol == 'usb' else args.port, None)]
+        where = args.port
+    server = start_server(sim, endpoints=endpoints)
     try:
-        init_curses()
-        sim.start()
-        start_server()
+        if args.headless:
+            try:
+                report(sim, args.interval)
+            except KeyboardInterrupt:
+                pass
+            return
+        info = "W: {} H: {} Portrait: {} Panels: {} Port: {}".format(
+            sim.size[0], sim.size[1], args.portrait, sum(len(g) for g in sim.gateways.values()), where)
+        view = TerminalView(sim, args.refresh, args.portrait, args.verbose, info)
         try:
-            while True:
-                time.sleep(0.01)
-        except KeyboardInterrupt:
-            pass
-        sim.stop()
+            view.open()
+            view.start()
+            try:
+                while True:
+                    time.sleep(0.01)
+            except KeyboardInterrupt:
+                pass
+            view.stop()
+        finally:
+            view.close()
     finally:
-        stop_curses()
+        stop_server(server)
+
+
+if __name__ == "__main__":
+    main()
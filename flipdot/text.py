@@ -0,0 +1,150 @@
+#! /usr/bin/env python
+#
+# text.py -- cached text rendering for displays
+
+from collections import OrderedDict
+
+from PIL import Image, ImageDraw, ImageFont
+
+# threshold rendered text at the same level as Display packing so the strips
+# paste into any display mode without dithering
+_LIT = [255 if 3 * v > 400 else 0 for v in range(256)]
+
+
+def _advance(font, ch):
+    if hasattr(font, 'getlength'):
+        return font.getlength(ch)
+    return font.getsize(ch)[0]
+
+
+def _bbox(font, text):
+    if hasattr(font, 'getbbox'):
+        return font.getbbox(text)
+    w, h = font.getsize(text)
+    return (0, 0, w, h)
+
+
+def _line_height(font):
+    if hasattr(font, 'getmetrics'):
+        ascent, descent = font.getmetrics()
+        return ascent + descent
+    return _bbox(font, "Ay")[3]
+
+
+class TextRenderer(object):
+    """
+    Renders strings for one font (and so size) by composing glyphs from an
+    atlas that is rasterised once per character, and keeps an LRU cache of
+    rendered strings. Scrolling text is then a window sliding over one
+    rendered strip rather than rasterising the string every frame.
+
+    Strings are composed from single glyphs at their advances so kerning
+    pairs are not applied.
+    """
+
+    def __init__(self, font=None, cache_size=64, max_bytes=1 << 20):
+        """
+        Keyword arguments:
+        font -- PIL ImageFont, the PIL default font if None
+        cache_size -- maximum number of rendered strings kept
+        max_bytes -- maximum total size of rendered strings kept
+        """
+        self.font = font if font is not None else ImageFont.load_default()
+        self.cache_size = cache_size
+        self.max_bytes = max_bytes
+        self.height = _line_height(self.font)
+        # char -> (thresholded "L" glyph image, x offset, advance)
+        self.atlas = {}
+        self.cache = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def glyph(self, ch):
+        """
+        Atlas entry for a character, rasterising it on first use
+        """
+        g = self.atlas.get(ch)
+        if g is None:
+            left, _, right, _ = _bbox(self.font, ch)
+            pad = max(0, -left)
+            advance = _advance(self.font, ch)
+            im = Image.new("L", (max(1, int(max(right, advance)) + pad), self.height))
+            ImageDraw.Draw(im).text((pad, 0), ch, font=self.font, fill=255)
+            g = (im.point(_LIT), -pad, advance)
+            self.atlas[ch] = g
+        return g
+
+    def size(self, text):
+        """
+        (w, h) of the rendered text
+        """
+        return self.render(text).size
+
+    def render(self, text):
+        """
+        Thresholded "L" image of the text, lit dots 255
+        """
+        im = self.cache.get(text)
+        if im is not None:
+            self.hits += 1
+            self.cache.move_to_end(text)
+            return im
+        self.misses += 1
+        glyphs = [self.glyph(ch) for ch in text]
+        x = 0.0
+        width = 0
+        for g, offset, advance in glyphs:
+            width = max(width, int(round(x)) + offset + g.size[0])
+            x += advance
+        width = max(width, int(round(x)))
+        im = Image.new("L", (max(1, width), self.height))
+        x = 0.0
+        for g, offset, advance in glyphs:
+            im.paste(g, (int(round(x)) + offset, 0), g)
+            x += advance
+        self.store(text, im)
+        return im
+
+    def store(self, text, im):
+        self.cache[text] = im
+        self.bytes += im.size[0] * im.size[1]
+        while self.cache and (len(self.cache) > self.cache_size or self.bytes > self.max_bytes):
+            _, old = self.cache.popitem(last=False)
+            self.bytes -= old.size[0] * old.size[1]
+
+    def draw(self, im, xy, text):
+        """
+        Draw text into image im at xy (which may be partly off the image),
+        like ImageDraw.text with fill white
+        """
+        strip = self.render(text)
+        im.paste(strip, tuple(int(v) for v in xy), strip)
+
+    def stats(self):
+        """
+        Cache statistics
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self.cache),
+            'bytes': self.bytes,
+            'glyphs': len(self.atlas),
+        }
+
+
+# font -> TextRenderer shared by all users of the font
+_renderers = {}
+
+
+def renderer(font=None, **kwargs):
+    """
+    Shared TextRenderer for a font, created on first use with kwargs
+    """
+    r = _renderers.get(font)
+    if r is None:
+        r = _renderers[font] = TextRenderer(font, **kwargs)
+    return r
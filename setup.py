@@ -17,7 +17,8 @@ setup(
     author_email='git@jbrengineering.co.uk',
     url='https://github.com/tuna-f1sh/flipdot',
     license=license,
-    packages=find_packages(exclude=('tests', 'docs')),
+    python_requires='>=3.7',
+    packages=find_packages(exclude=('tests', 'tests.*', 'docs', 'benchmarks', 'benchmarks.*')),
     install_requires=[
         'Pillow',
         'pyserial',
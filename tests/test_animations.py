@@ -0,0 +1,36 @@
+import pytest
+from PIL import Image
+
+from flipdot import display
+from flipdot.sequence import CaptureDisplay
+from flipdot.text import renderer
+from demo import animations
+
+
+def reference_scroll(d, text, font, xy, rotate):
+    # the per frame path scroll_text replaced: draw into a scratch image
+    # with w/h flipped and rotate it into the display
+    r = renderer(font)
+    tw, _ = r.size(text)
+    frames = []
+    for x in range(xy[0], 0 - tw - 1, -1):
+        if rotate:
+            canvas = Image.new(d.im.mode, d.im.size[::-1])
+        else:
+            canvas = Image.new(d.im.mode, d.im.size)
+        r.draw(canvas, (x, xy[1]), text)
+        if rotate:
+            canvas = canvas.rotate(angle=-90, expand=1)
+        d.im.paste(canvas)
+        frames.append(d.pack())
+    return frames
+
+
+@pytest.mark.parametrize('rotate', [False, True])
+@pytest.mark.parametrize('xy', [(0, 0), (5, 2)])
+def test_scroll_text_matches_per_frame_rendering(rotate, xy):
+    font = animations.asset('SmallFont')
+    d = CaptureDisplay(56, 14, display.create_display((28, 7), (56, 14)))
+    animations.scroll_text(d, 'Rotated', font=font, xy=xy, rotate=rotate)
+    expected = reference_scroll(CaptureDisplay(56, 14, d.panels), 'Rotated', font, xy, rotate)
+    assert [packed for _, packed, _ in d.captured] == expected
@@ -0,0 +1,88 @@
+import random
+
+import pytest
+
+from flipdot import display
+
+PANEL = (28, 7)
+
+# a pixel each side of the threshold: lit when r + g + b > 400, for L when
+# 3 * v > 400
+BOUNDARY = {
+    'RGB': [(133, 133, 134), (134, 133, 134), (0, 200, 200), (0, 200, 201),
+            (255, 145, 0), (255, 146, 0), (0, 0, 0), (255, 255, 255)],
+    'L': [133, 134, 0, 255],
+    '1': [0, 255],
+}
+
+
+def noise(im, seed=1):
+    # random pixels, weighted towards the threshold so both sides of it
+    # come up often
+    rnd = random.Random(seed)
+    w, h = im.size
+    values = BOUNDARY[im.mode]
+    if im.mode == 'RGB':
+        def pixel():
+            if rnd.random() < 0.5:
+                return rnd.choice(values)
+            return tuple(rnd.randrange(256) for _ in range(3))
+    elif im.mode == 'L':
+        def pixel():
+            return rnd.choice(values) if rnd.random() < 0.5 else rnd.randrange(256)
+    else:
+        def pixel():
+            return rnd.choice(values)
+    im.putdata([pixel() for _ in range(w * h)])
+
+
+def reference(d, address):
+    # panel bytes a dot at a time, as to_bytes used to: bit r of column c
+    # is the dot at row r, placed by the panel's rotation and mirroring
+    px = d.im.load()
+    (xs, ys), (w, h), rotate, mirror = display.panel_orientation(d.panels[address])
+    result = bytearray()
+    for c in range(w):
+        b = 0
+        for r in range(h):
+            x, y = display.orient(c, r, w, h, rotate, mirror)
+            b |= d.px_to_bit(px[xs + x, ys + y]) << r
+        result.append(b)
+    return result
+
+
+def displays(mode):
+    yield display.Display(56, 14, display.create_display(PANEL, (56, 14)), mode=mode)
+    # a single panel and one that isn't at the image origin
+    yield display.Display(28, 7, {3: ((0, 0), PANEL)}, mode=mode)
+    yield display.Display(40, 10, {1: ((5, 2), PANEL)}, mode=mode)
+    # mixed rotated and mirrored panels, packed through the compiled maps
+    yield display.Display(42, 28, {
+        1: ((0, 0), PANEL, 90),
+        2: ((7, 0), PANEL, 270, True),
+        3: ((14, 0), PANEL, 180),
+        4: ((14, 7), PANEL, 0, True),
+        5: ((14, 14), PANEL, 180, True),
+        6: ((14, 21), PANEL),
+    }, mode=mode)
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+@pytest.mark.parametrize('mode', display.MODES)
+def test_pack_matches_reference(mode, seed):
+    for d in displays(mode):
+        noise(d.im, seed)
+        expected = {a: reference(d, a) for a in d.panels}
+        assert d.pack() == expected
+        for a in d.panels:
+            assert d.to_bytes(a) == expected[a]
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'L'])
+def test_threshold_boundary(mode):
+    values = BOUNDARY[mode]
+    d = display.Display(len(values), 7, {0: ((0, 0), (len(values), 7))}, mode=mode)
+    d.im.putdata(values * 7)
+    lit = [sum(v) > 400 if mode == 'RGB' else 3 * v > 400 for v in values]
+    assert d.pack()[0] == bytearray(0x7f if on else 0 for on in lit)
+    assert d.to_bytes(0) == d.pack()[0]
@@ -0,0 +1,73 @@
+import random
+
+import pytest
+
+from flipdot import display
+
+PANEL = (28, 7)
+
+
+def noise(im, seed=1):
+    rnd = random.Random(seed)
+    w, h = im.size
+    im.putdata([tuple(rnd.randrange(256) for _ in range(3)) for _ in range(w * h)])
+
+
+def split_pack(md):
+    # the old path: crop, rotate and mirror each display's image out of the
+    # multi display image, then pack every display on its own
+    md.split()
+    return {dID: entry[1].pack() for dID, entry in md.displays.items()}
+
+
+def gateway(w, h, panels=None):
+    return display.Display(w, h, panels or display.create_display(PANEL, (w, h)))
+
+
+@pytest.mark.parametrize('seed', [1, 2])
+def test_landscape(seed):
+    md = display.MultiDisplay(112, 14, {
+        0: ((0, 0), gateway(56, 14)),
+        1: ((56, 0), gateway(56, 14)),
+    })
+    noise(md.im, seed)
+    assert md.pack() == split_pack(md)
+
+
+@pytest.mark.parametrize('seed', [1, 2])
+def test_portrait(seed):
+    # portrait displays are tall and turned on their side, at swapped x, y
+    md = display.MultiDisplay(112, 28, {
+        0: ((0, 0), gateway(28, 56)),
+        1: ((0, 56), gateway(28, 56)),
+    }, portrait=True)
+    noise(md.im, seed)
+    assert md.pack() == split_pack(md)
+
+
+@pytest.mark.parametrize('mirror', [False, True])
+@pytest.mark.parametrize('rotate', [0, 90, 180, 270])
+def test_rotated_and_mirrored(rotate, mirror):
+    w, h = 56, 14
+    fw, fh = display.footprint((w, h), rotate)
+    md = display.MultiDisplay(fw + w, max(fh, h), {
+        'turned': ((0, 0), gateway(w, h), rotate, mirror),
+        'plain': ((fw, 0), gateway(w, h), 0, False),
+    })
+    noise(md.im, rotate + mirror)
+    assert md.pack() == split_pack(md)
+
+
+@pytest.mark.parametrize('rotate', [0, 90, 180, 270])
+def test_rotated_panels_in_rotated_display(rotate):
+    # panel rotation and mirroring compose with that of the display
+    panels = {
+        1: ((0, 0), PANEL, 180),
+        2: ((28, 0), PANEL, 0, True),
+        3: ((0, 7), PANEL, 180, True),
+        4: ((28, 7), PANEL),
+    }
+    fw, fh = display.footprint((56, 14), rotate)
+    md = display.MultiDisplay(fw, fh, {0: ((0, 0), gateway(56, 14, panels), rotate, False)})
+    noise(md.im, rotate)
+    assert md.pack() == split_pack(md)
@@ -0,0 +1,68 @@
+import pytest
+
+from flipdot import record
+from flipdot.client import Client
+
+PANELS = {
+    1: ((0, 0), (28, 7)),
+    2: ((28, 0), (28, 7), 180),
+}
+
+
+class ListClient(Client):
+    """
+    Client keeping each batch sent as a list of (address, data, refresh)
+    """
+
+    def __init__(self):
+        super(ListClient, self).__init__()
+        self.batches = []
+
+    def send_many(self, frames, latch=False):
+        self.batches.append(([(a, bytes(d), r) for a, d, r in frames], latch))
+
+
+def frames():
+    # full frames, then single column changes that delta encode well, then
+    # a latch of data sent without refresh
+    a = bytes(range(28))
+    b = bytes(0x7F - i for i in range(28))
+    yield [(1, a, True), (2, b, True)], False
+    yield [(1, a[:5] + b'\x00' + a[6:], True)], False
+    yield [(2, b[:27] + b'\x01', True), (1, a, True)], False
+    yield [(1, b, False), (2, a, False)], True
+
+
+def write(path, delta):
+    times = iter(i * 0.5 for i in range(100))
+    with record.Recorder(str(path), (56, 7), PANELS, delta=delta, clock=lambda: next(times)) as r:
+        for batch, latch in frames():
+            r.write(batch, latch)
+    return path.stat().st_size
+
+
+@pytest.mark.parametrize('delta', [False, True])
+def test_round_trip(tmp_path, delta):
+    path = tmp_path / 'rec.fdot'
+    write(path, delta)
+    now = [0.0]
+    c = ListClient()
+    with record.Player(str(path)) as p:
+        assert p.size == (56, 7)
+        assert p.panels == {1: PANELS[1], 2: PANELS[2] + (False,)}
+        sent = p.play(c, clock=lambda: now[0], sleep=lambda s: now.__setitem__(0, now[0] + s))
+    assert sent == 4
+    assert c.batches == list(frames())
+    # played at the recorded half second intervals
+    assert now[0] == pytest.approx(1.5)
+
+
+def test_delta_is_smaller(tmp_path):
+    assert write(tmp_path / 'delta.fdot', True) < write(tmp_path / 'full.fdot', False)
+
+
+def test_not_a_recording(tmp_path):
+    path = tmp_path / 'junk'
+    path.write_bytes(b'JUNK' + bytes(20))
+    with pytest.raises(ValueError):
+        record.Player(str(path))
@@ -0,0 +1,54 @@
+import pytest
+
+from flipdot.scheduler import FrameScheduler
+
+
+class SlowDisplay(object):
+    """
+    Display whose sends take longer than a frame, on a virtual clock
+    """
+
+    def __init__(self, send_time):
+        self.now = 0.0
+        self.send_time = send_time
+        self.sent = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def send(self, **kwargs):
+        self.sent.append(kwargs)
+        self.now += self.send_time
+
+
+def test_drops_frames_when_behind():
+    d = SlowDisplay(0.25)
+    s = FrameScheduler(d, fps=10)
+    for i in range(10):
+        s.send(packed=i)
+    s.finish()
+    assert s.dropped > 0
+    assert s.frames + s.dropped == 10
+
+
+def test_finish_sends_last_dropped_frame_with_its_arguments():
+    d = SlowDisplay(0.25)
+    s = FrameScheduler(d, fps=10)
+    for i in range(10):
+        s.send(packed=i, refresh=True)
+    s.finish()
+    assert d.sent[-1] == {'packed': 9, 'refresh': True}
+
+
+def test_keeps_pace_when_fast():
+    d = SlowDisplay(0.0)
+    s = FrameScheduler(d, fps=10)
+    for i in range(10):
+        s.send(packed=i)
+    s.finish()
+    assert s.dropped == 0
+    assert [k['packed'] for k in d.sent] == list(range(10))
+    assert d.now == pytest.approx(1.0)
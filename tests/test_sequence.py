@@ -0,0 +1,60 @@
+import os
+
+from flipdot import display, sequence
+
+
+def blink(d, n):
+    for i in range(n):
+        d.reset(white=bool(i % 2))
+        d.send()
+        d.sleep(0.1)
+
+
+def wall():
+    return display.Display(56, 7, display.create_display((28, 7), (56, 7)))
+
+
+def test_disk_round_trip(tmp_path):
+    d = wall()
+    cache = sequence.SequenceCache(str(tmp_path))
+    seq = cache.get(d, blink, 3)
+    assert cache.misses == 1
+    # a fresh cache reads the same frames back from disk
+    again = sequence.SequenceCache(str(tmp_path))
+    loaded = again.get(d, blink, 3)
+    assert again.hits == 1 and again.misses == 0
+    assert loaded.frames == seq.frames
+    assert loaded.geometry == seq.geometry
+
+
+def test_bad_files_are_recompiled(tmp_path):
+    d = wall()
+    cache = sequence.SequenceCache(str(tmp_path))
+    cache.get(d, blink, 2)
+    [name] = os.listdir(str(tmp_path))
+    path = os.path.join(str(tmp_path), name)
+    with open(path, 'rb') as f:
+        good = f.read()
+    for bad in (b'', good[:-3], good + b'\x00', b'\x80\x04junk' + good):
+        with open(path, 'wb') as f:
+            f.write(bad)
+        fresh = sequence.SequenceCache(str(tmp_path))
+        fresh.get(d, blink, 2)
+        assert fresh.misses == 1
+
+
+def test_key_follows_code():
+    d = wall()
+    cache = sequence.SequenceCache()
+
+    def one(d):
+        d.send()
+
+    def two(d):
+        d.reset(white=True)
+        d.send()
+
+    # same qualified name, different code
+    two.__qualname__ = one.__qualname__
+    assert cache.key(d, one, (), {}) != cache.key(d, two, (), {})
+    assert cache.key(d, one, (), {}) == cache.key(d, one, (), {})
@@ -0,0 +1,166 @@
+import asyncio
+import threading
+import time
+
+from flipdot import sim
+from flipdot.client import Client
+
+PANEL = bytes(range(28))
+
+
+def message(address, data, refresh=True):
+    return bytes(Client().format_message(address, data, refresh))
+
+
+def test_parser_whole_frames():
+    msgs = [message(1, PANEL), sim.LATCH, message(2, bytes(56)), message(3, bytes(112))]
+    p = sim.FrameParser()
+    assert p.feed(b''.join(msgs)) == msgs
+    assert p.skipped == 0
+    assert not p.buf
+
+
+def test_parser_split_chunks():
+    msgs = [message(a, PANEL) for a in range(1, 5)] + [sim.LATCH]
+    stream = b''.join(msgs)
+    p = sim.FrameParser()
+    frames = []
+    # every chunk size, so frames are split at every offset
+    for size in range(1, len(stream) + 1):
+        for i in range(0, len(stream), size):
+            frames += p.feed(stream[i:i + size])
+        assert frames == msgs
+        frames = []
+    assert p.skipped == 0
+
+
+def test_parser_resyncs_on_garbage():
+    good = message(1, PANEL)
+    # junk before a frame, a start byte with an unknown command and a frame
+    # cut short by the next start
+    junk = b'\x00\x7f\x12'
+    unknown = b'\x80\x10'
+    short = message(2, PANEL)[:10]
+    p = sim.FrameParser()
+    frames = p.feed(junk + good + unknown + short + good)
+    assert frames == [good, good]
+    assert p.skipped == len(junk) + len(unknown) + len(short)
+
+
+def test_problem():
+    assert sim.problem(message(1, PANEL)) is None
+    assert sim.problem(sim.LATCH) is None
+    assert sim.problem(b'\x80\x83') == 'too short'
+    assert sim.problem(message(1, PANEL)[:-1] + b'\x00') == 'no end'
+    assert sim.problem(message(1, PANEL)[:-2] + b'\x8f') == 'bad length'
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def timed_sim():
+    clock = Clock()
+    panels = {1: ((0, 0), (28, 7)), 2: ((28, 0), (28, 7))}
+    return sim.DisplaySim(56, 7, panels, timing=sim.TimingModel(clock=clock)), clock
+
+
+def shown(data):
+    s = sim.DisplaySim(56, 7, {1: ((0, 0), (28, 7)), 2: ((28, 0), (28, 7))})
+    s.update(1, data)
+    return bytes(s.fb)
+
+
+def test_timing_no_refresh_waits_for_latch():
+    s, clock = timed_sim()
+    s.apply(message(1, bytes(28)))
+    s.apply(message(1, PANEL, refresh=False))
+    clock.now = 1.0
+    s.advance()
+    # written but not shown until latched
+    assert not any(s.fb)
+    s.apply(sim.LATCH)
+    assert not any(s.fb)
+    # the latch takes effect once clocked out on the bus
+    clock.now += 4 * s.timing.byte_time
+    s.advance()
+    assert bytes(s.fb) == shown(PANEL)
+    assert s.latches == 1
+
+
+def test_timing_refresh_after_bus_time():
+    s, clock = timed_sim()
+    s.apply(message(1, PANEL))
+    assert not any(s.fb)
+    assert s.stats()['queued'] == 1
+    clock.now = 31 * s.timing.byte_time
+    s.advance()
+    assert not any(s.fb)
+    clock.now = 32 * s.timing.byte_time
+    s.advance()
+    assert bytes(s.fb) == shown(PANEL)
+
+
+def test_timing_superseded_before_latch():
+    s, clock = timed_sim()
+    s.apply(message(1, bytes(28), refresh=False))
+    s.apply(message(1, PANEL, refresh=False))
+    s.apply(sim.LATCH)
+    clock.now = 1.0
+    stats = s.stats()
+    assert stats['superseded'] == 1
+    assert stats['queued'] == 0
+    assert bytes(s.fb) == shown(PANEL)
+
+
+class FakeSerial(object):
+    """
+    Serial port handing out a stream in small chunks, then waiting
+    """
+
+    def __init__(self, stream, size=7):
+        self.chunks = [stream[i:i + size] for i in range(0, len(stream), size)]
+        self.in_waiting = 0
+        self.is_open = False
+        self.done = threading.Event()
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def read(self, n):
+        if not self.chunks:
+            self.done.set()
+            time.sleep(0.01)
+            return b''
+        return self.chunks.pop(0)
+
+
+def test_serial_chunks_applied_on_server_loop():
+    s = sim.DisplaySim(56, 7, {1: ((0, 0), (28, 7)), 2: ((28, 0), (28, 7))})
+    server = sim.Server(s, [('usb', None, 'fake', None)])
+    handler = server.serials[0]
+    handler.chan = FakeSerial(message(1, PANEL) + message(2, PANEL))
+    threads = set()
+    apply = s.apply
+
+    def recording(*args):
+        threads.add(threading.current_thread())
+        return apply(*args)
+
+    s.apply = recording
+    server.open()
+    try:
+        assert handler.chan.done.wait(5)
+        # anything queued behind the last chunk has run once this does
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0), server.loop).result(5)
+    finally:
+        server.close()
+    assert threads == {server}
+    assert s.stats()['frames'] == 2